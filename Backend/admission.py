@@ -0,0 +1,202 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from PIL import Image
+
+from frames import is_multiframe
+from pipeline import array_mode
+from registry import POINT, implementations, scratch
+
+# Image-sized arrays every whole-image request holds at its peak besides the
+# decoded PIL image: the input array, the result and the copy encoding makes
+ARRAY_COPIES = 2.0
+# Shared-memory input and output blocks plus the result copied out of them
+POOL_COPIES = 2.0
+# Band temporaries, lookup tables and interpreter overhead per request
+REQUEST_OVERHEAD_BYTES = 16 * 1024 * 1024
+
+
+class AdmissionError(RuntimeError):
+    """Raised when a request is not admitted to processing."""
+
+
+class ImageTooLargeError(AdmissionError):
+    """The request alone would need more memory than the whole budget."""
+
+
+class MemoryBusyError(AdmissionError):
+    """The budget stayed full for as long as the request could wait."""
+
+
+def read_header(source):
+    """(width, height, channels, format, frames) from an image header, without decoding pixels.
+
+    Truncated files are still decoded to their full declared size
+    (LOAD_TRUNCATED_IMAGES), so the header is what PIL will allocate.
+    frames counts the frames processed: every frame of an animated GIF or
+    multi-page TIFF, otherwise 1. Later frames are assumed no larger than
+    the first.
+    """
+    try:
+        with Image.open(source) as image:
+            frames = image.n_frames if is_multiframe(image) else 1
+            return image.width, image.height, len(array_mode(image)), image.format, frames
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e))
+
+
+def physical_memory_bytes(default=4 * 1024**3):
+    """Total RAM of the machine, or default where the OS does not say."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return default
+
+
+def _preview_scale(header, preview):
+    width, height = header[:2]
+    if preview is None or max(width, height) <= preview:
+        return 1.0
+    return preview / max(width, height)
+
+
+def processed_size(header, preview=None):
+    """(width, height) the steps will run at: the header size, or its preview size."""
+    scale = _preview_scale(header, preview)
+    return max(round(header[0] * scale), 1), max(round(header[1] * scale), 1)
+
+
+def estimate_bytes(header, steps, backend, preview=None, pooled=False, tile_budget=None, frame_workers=1):
+    """Estimated peak bytes of working memory for one request.
+
+    header comes from read_header and steps from parse_steps. preview is
+    the long-edge size of a preview render; pooled means the steps run in
+    the process pool, whose shared-memory blocks add to the total. With
+    tile_budget the request is costed for tiled processing, which keeps
+    only the decoded image and the strips it is working on in memory.
+    Multi-frame images (previews aside, which only use the first frame)
+    are costed for frame_workers frames in flight plus the encoded output
+    of all of them.
+    """
+    width, height, channels, fmt, frames = header
+    pixels = width * height
+    scale = _preview_scale(header, preview)
+
+    # PIL stores RGB as 4 bytes per pixel. Only JPEG previews are decoded
+    # at reduced size (at most twice the preview on each side).
+    decoded_pixels = pixels * min(4 * scale * scale, 1.0) if fmt == "JPEG" else pixels
+    decode_bytes = decoded_pixels * (1 if channels == 1 else 4)
+    array_bytes = pixels * scale * scale * channels
+
+    if tile_budget is not None:
+        return int(decode_bytes + tile_budget + array_bytes * ARRAY_COPIES + REQUEST_OVERHEAD_BYTES)
+
+    copies = ARRAY_COPIES + max((scratch(name, backend) for name, _ in steps), default=0.0)
+    filters = [name for name, _ in steps if any(info.kind != POINT for info in implementations(name).values())]
+    if len(filters) > 1:
+        copies += 1  # An intermediate and the next result exist side by side
+    if pooled:
+        copies += POOL_COPIES
+    if frames > 1 and preview is None:
+        # The GIF writer keeps a palette copy of every frame until the end,
+        # and neither writer's output is more than the raw pixels
+        in_flight = min(frames, frame_workers)
+        output_bytes = frames * pixels * max(channels, 2)
+        return int(2 * decode_bytes + in_flight * array_bytes * copies + output_bytes + REQUEST_OVERHEAD_BYTES)
+    return int(decode_bytes + array_bytes * copies + REQUEST_OVERHEAD_BYTES)
+
+
+class MemoryBudget:
+    """Admit requests while their estimated working memory fits a server-wide budget.
+
+    A request that does not fit right away queues, in arrival order, for
+    up to max_wait seconds; with max_waiting requests already queued, or
+    once the wait runs out, it fails with MemoryBusyError so the client can
+    retry later. A request whose estimate alone exceeds the budget can
+    never run and fails with ImageTooLargeError.
+
+    reserved_bytes of the budget are held back for memory no request
+    accounts for, such as the idle arrays buffer pools keep between
+    requests; requests share the rest, request_bytes.
+    """
+
+    def __init__(self, budget_bytes, max_wait, max_waiting, reserved_bytes=0):
+        self.budget_bytes = budget_bytes
+        self.reserved_bytes = reserved_bytes
+        self.request_bytes = max(budget_bytes - reserved_bytes, 0)
+        self.max_wait = max_wait
+        self.max_waiting = max_waiting
+        self.in_use = 0
+        self.admitted = 0
+        self.queued = 0
+        self.busy = 0
+        self.too_large = 0
+        self._waiting = deque()
+        self._condition = threading.Condition()
+
+    def acquire(self, cost):
+        """Reserve cost bytes, waiting for room if needed."""
+        if cost > self.request_bytes:
+            with self._condition:
+                self.too_large += 1
+            raise ImageTooLargeError(
+                f"Image needs about {cost // 2**20}MB to process, "
+                f"more than the server's {self.request_bytes // 2**20}MB budget"
+            )
+
+        with self._condition:
+            if self._waiting or self.in_use + cost > self.request_bytes:
+                self._wait_for_room(cost)
+            self.in_use += cost
+            self.admitted += 1
+
+    def _wait_for_room(self, cost):
+        """Queue until this request is first in line and fits (lock held)."""
+        if len(self._waiting) >= self.max_waiting:
+            self.busy += 1
+            raise MemoryBusyError("Too many requests waiting for memory")
+
+        ticket = object()
+        self._waiting.append(ticket)
+        self.queued += 1
+        deadline = time.monotonic() + self.max_wait
+        try:
+            while self._waiting[0] is not ticket or self.in_use + cost > self.request_bytes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.busy += 1
+                    raise MemoryBusyError("Timed out waiting for memory")
+                self._condition.wait(remaining)
+        finally:
+            self._waiting.remove(ticket)
+            self._condition.notify_all()  # The next in line may fit now
+
+    def release(self, cost):
+        with self._condition:
+            self.in_use -= cost
+            self._condition.notify_all()
+
+    @contextmanager
+    def reserve(self, cost):
+        """Hold cost bytes of the budget for the duration of a with block."""
+        self.acquire(cost)
+        try:
+            yield
+        finally:
+            self.release(cost)
+
+    def stats(self):
+        with self._condition:
+            return {
+                "budget_bytes": self.budget_bytes,
+                "reserved_bytes": self.reserved_bytes,
+                "in_use_bytes": self.in_use,
+                "waiting": len(self._waiting),
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "busy": self.busy,
+                "too_large": self.too_large,
+            }
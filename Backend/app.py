@@ -1,51 +1,247 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context, g, has_request_context
 from flask_cors import CORS
 from processing import (
-    convert_grayscale, quantize_image, histogram_equalization,
-    smooth_filter, sharpen_filter, high_pass_filter, low_pass_filter
+    OPERATIONS, TILED_GLOBAL_OPERATIONS
 )
-from PIL import Image
+from pipeline import (
+    PipelineError, parse_steps, parse_form_steps, parse_preview, operation_parameters, scale_steps,
+    load_image, image_to_array
+)
+from encoding import EncodingError, DEFAULT_OUTPUT, parse_output_options, encode_array
+from cache import ResultCache
+from buffers import DEFAULT_POOL_BYTES, POOL
+from admission import (
+    ImageTooLargeError, MemoryBudget, MemoryBusyError, estimate_bytes, physical_memory_bytes, processed_size,
+    read_header
+)
+from memory_request import InMemoryRequest
+from workers import ProcessingPool, QueueFullError, WorkerCrashedError
+from jobs import JobQueueFullError, JobStore
+from upload_store import UploadQuotaError, UploadStore
+from batch import iter_batch_inputs, stream_batch
+from metrics import RequestTiming, render_prometheus
+from tiling import is_tileable, result_rows, run_tiled
+from frames import is_multiframe, process_frames
+from registry import Dispatcher, describe_operations, run_plan
 import os
 import io
 import shutil
 import time
 import threading
+from contextlib import contextmanager
 
 app = Flask(__name__)
+app.request_class = InMemoryRequest  # Keep multipart uploads off the disk
 
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB limit
 
 
-CORS(app)
+# Let the browser read the timing/size headers attached to results
+CORS(app, expose_headers=["X-Encode-Time-Ms", "X-Output-Bytes", "Retry-After"])
 
 UPLOAD_FOLDER = "uploads"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Uploads are stored once per content hash and deleted after UPLOAD_MAX_AGE
+# seconds, or earlier, least recently used first, to stay under the quota
+UPLOAD_MAX_AGE = int(os.environ.get("UPLOAD_MAX_AGE", 3600))  # 1 hour
+UPLOAD_QUOTA_BYTES = int(os.environ.get("UPLOAD_QUOTA_BYTES", 1024 * 1024 * 1024))  # 1GB
+upload_store = UploadStore(UPLOAD_FOLDER, UPLOAD_MAX_AGE, UPLOAD_QUOTA_BYTES)
+
+# Encoded results keyed by upload hash + operations, shared by all requests
+RESULT_CACHE_BYTES = int(os.environ.get("RESULT_CACHE_BYTES", 64 * 1024 * 1024))  # 64MB
+result_cache = ResultCache(RESULT_CACHE_BYTES)
+
+# CPU-bound operations run in a process pool (0 workers = on the request thread).
+# Once workers + queue depth requests are in flight, new ones get a 503.
+PROCESSING_BACKEND = "processing"
+PROCESS_POOL_WORKERS = int(os.environ.get("PROCESS_POOL_WORKERS", min(4, os.cpu_count() or 1)))
+PROCESS_POOL_QUEUE = int(os.environ.get("PROCESS_POOL_QUEUE", 2 * PROCESS_POOL_WORKERS))
+RETRY_AFTER_SECONDS = int(os.environ.get("RETRY_AFTER_SECONDS", 2))
+processing_pool = (
+    ProcessingPool(PROCESS_POOL_WORKERS, PROCESS_POOL_QUEUE) if PROCESS_POOL_WORKERS > 0 else None
+)
+
+# With AUTO_BACKEND=1 each operation runs on whichever importable backend
+# was fastest on similar images, profiled at startup or read from
+# BACKEND_PROFILE (profiled once, by the first worker to start, when
+# missing). Operations whose backends differ by more than
+# AUTO_BACKEND_MAX_DIFF levels stay on PROCESSING_BACKEND; at the default
+# of 0 only quantize and boxblur give identical results and can switch.
+AUTO_BACKEND = os.environ.get("AUTO_BACKEND", "").lower() in ("1", "true", "yes")
+BACKEND_PROFILE = os.environ.get("BACKEND_PROFILE", "backend_profile.json")
+AUTO_BACKEND_MAX_DIFF = int(os.environ.get("AUTO_BACKEND_MAX_DIFF", 0))
+dispatcher = (
+    Dispatcher.load(PROCESSING_BACKEND, BACKEND_PROFILE, AUTO_BACKEND_MAX_DIFF) if AUTO_BACKEND else None
+)
+
+# Images of at least TILE_THRESHOLD_PIXELS are filtered in strips that fit
+# TILE_MEMORY_BUDGET, with intermediates in memory-mapped scratch files
+TILE_THRESHOLD_PIXELS = int(os.environ.get("TILE_THRESHOLD_PIXELS", 25_000_000))
+TILE_MEMORY_BUDGET = int(os.environ.get("TILE_MEMORY_BUDGET", 256 * 1024 * 1024))  # 256MB
+TILE_SCRATCH_DIR = os.environ.get("TILE_SCRATCH_DIR") or None
+
+# Requests are admitted while the estimated peak memory of everything in
+# flight fits MEMORY_BUDGET_BYTES (default: half the machine's RAM). Others
+# wait in line for up to ADMISSION_MAX_WAIT seconds, at most ADMISSION_QUEUE
+# of them; images that could never fit get a 413. The budget includes the
+# idle arrays the buffer pool may keep, BUFFER_POOL_BYTES in this process
+# and again in every process pool worker, so that much is held back.
+MEMORY_BUDGET_BYTES = int(os.environ.get("MEMORY_BUDGET_BYTES", physical_memory_bytes() // 2))
+ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", 10))
+ADMISSION_QUEUE = int(os.environ.get("ADMISSION_QUEUE", 16))
+
+# Idle image-sized arrays kept for reuse by later requests (see buffers.py),
+# by default at most 64MB per process and an eighth of the budget for all of
+# them together. Forked children start with an empty pool.
+BUFFER_POOL_BYTES = int(os.environ.get(
+    "BUFFER_POOL_BYTES", min(DEFAULT_POOL_BYTES, MEMORY_BUDGET_BYTES // (8 * (1 + max(PROCESS_POOL_WORKERS, 0))))
+))
+POOL.resize(BUFFER_POOL_BYTES)
+
+memory_budget = MemoryBudget(
+    MEMORY_BUDGET_BYTES, ADMISSION_MAX_WAIT, ADMISSION_QUEUE,
+    reserved_bytes=BUFFER_POOL_BYTES * (1 + max(PROCESS_POOL_WORKERS, 0)),
+)
+
+# Background jobs for work that may outlive the proxy's request timeout.
+# At most JOB_WORKERS + JOB_QUEUE jobs are pending (each holds its upload);
+# more get a 503. Finished results are kept up to JOB_RESULT_BYTES in total,
+# oldest first out, and a job that cannot get into the busy processing
+# pool or memory budget within JOB_MAX_WAIT seconds fails.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_QUEUE = int(os.environ.get("JOB_QUEUE", 4 * JOB_WORKERS))
+JOB_RESULT_BYTES = int(os.environ.get("JOB_RESULT_BYTES", 128 * 1024 * 1024))  # 128MB
+JOB_MAX_WAIT = float(os.environ.get("JOB_MAX_WAIT", 300))
+job_store = JobStore(JOB_WORKERS, JOB_WORKERS + JOB_QUEUE, JOB_RESULT_BYTES)
+
+# Images of one /batch request processed concurrently
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", max(PROCESS_POOL_WORKERS, 1)))
+# Largest uncompressed ZIP entry a /batch request may expand, like a single upload
+BATCH_MAX_ENTRY_BYTES = int(os.environ.get("BATCH_MAX_ENTRY_BYTES", 16 * 1024 * 1024))  # 16MB
 
-# Function to periodically clean up old files
-def cleanup_old_files(directory, max_age_seconds=3600):  # Default: 1 hour
-    """Remove files older than max_age_seconds from the directory"""
+# Frames of one animated GIF or multi-page TIFF processed concurrently
+FRAME_WORKERS = int(os.environ.get("FRAME_WORKERS", max(PROCESS_POOL_WORKERS, 1)))
+
+def expire_uploads(max_sleep=60):
+    """Delete uploads as they expire, waking for the next deadline instead of scanning the folder."""
     while True:
         try:
-            current_time = time.time()
-            for filename in os.listdir(directory):
-                file_path = os.path.join(directory, filename)
-                # Check if it's a file (not a directory) and older than max_age
-                if os.path.isfile(file_path) and (current_time - os.path.getmtime(file_path)) > max_age_seconds:
-                    try:
-                        os.remove(file_path)
-                        print(f"Cleaned up old file: {file_path}")
-                    except Exception as e:
-                        print(f"Failed to remove {file_path}: {e}")
+            expired = upload_store.expire()
+            if expired:
+                print(f"Expired {expired} uploaded files")
         except Exception as e:
             print(f"Error in cleanup task: {e}")
-        
-        # Sleep for a while before next cleanup
-        time.sleep(1800)  # Check every 30 minutes
+
+        # Finished job results expire on the same schedule as uploads
+        expired = job_store.purge_expired(UPLOAD_MAX_AGE)
+        if expired:
+            print(f"Expired {expired} finished jobs")
+
+        delay = upload_store.next_expiry()
+        time.sleep(max_sleep if delay is None else min(max(delay, 1.0), max_sleep))
 
 # Start cleanup thread
-cleanup_thread = threading.Thread(target=cleanup_old_files, args=(UPLOAD_FOLDER,), daemon=True)
+cleanup_thread = threading.Thread(target=expire_uploads, daemon=True)
 cleanup_thread.start()
 
+@app.before_request
+def start_request_timing():
+    g.timing = RequestTiming(request.endpoint or "unknown", PROCESSING_BACKEND)
+    g.timing.bytes_in = request.content_length or 0
+
+@app.after_request
+def finish_request_timing(response):
+    # Streamed responses (/batch) are recorded when streaming starts
+    timing = g.pop("timing", None)
+    if timing is not None and request.endpoint != "metrics":
+        timing.finish(response.status_code)
+    return response
+
+def current_timing():
+    """The current request's RequestTiming, or a throwaway one outside a request."""
+    if has_request_context() and "timing" in g:
+        return g.timing
+    return RequestTiming(None, PROCESSING_BACKEND)
+
+def should_tile(size, steps, cost):
+    """Use tiled processing for large images, or when whole-image processing would not fit the budget."""
+    if not is_tileable(steps, TILED_GLOBAL_OPERATIONS):
+        return False
+    return size[0] * size[1] >= TILE_THRESHOLD_PIXELS or cost > memory_budget.request_bytes
+
+@contextmanager
+def admitted(upload_bytes, steps, preview=None):
+    """Hold this request's estimated memory in the budget; yields whether to tile.
+
+    The cost comes from the image header alone, so nothing is decoded
+    before the request is admitted.
+    """
+    with current_timing().stage("admission"):
+        header = read_header(io.BytesIO(upload_bytes))
+        cost = estimate_bytes(
+            header, steps, PROCESSING_BACKEND, preview, pooled=processing_pool is not None,
+            frame_workers=FRAME_WORKERS,
+        )
+        # Multi-frame images go frame by frame instead (previews use only the first)
+        multiframe = header[4] > 1 and preview is None
+        tiled = not multiframe and should_tile(processed_size(header, preview), steps, cost)
+        if tiled:
+            cost = estimate_bytes(header, steps, PROCESSING_BACKEND, preview, tile_budget=TILE_MEMORY_BUDGET)
+        memory_budget.acquire(cost)
+    try:
+        yield tiled
+    finally:
+        memory_budget.release(cost)
+
+def execute_tiled(image, steps):
+    """Run steps on a PIL image strip by strip within the tile memory budget."""
+    current_timing().record_backends([PROCESSING_BACKEND])
+    return run_tiled(image, steps, OPERATIONS, TILED_GLOBAL_OPERATIONS, TILE_MEMORY_BUDGET, TILE_SCRATCH_DIR)
+
+def execute_steps(img_array, steps, timing=None):
+    """Run parsed steps on the chosen backends, in the process pool when enabled.
+
+    The backends used label the request's metrics; threads without the
+    request context pass its timing in.
+    """
+    if dispatcher is not None:
+        plan = dispatcher.plan(steps, img_array.shape)
+    else:
+        plan = [(PROCESSING_BACKEND, steps)]
+    (timing or current_timing()).record_backends(backend for backend, _ in plan)
+
+    if processing_pool is None:
+        return run_plan(img_array, plan)
+    return processing_pool.run(plan, img_array)
+
+def execute_frames(image, steps, progress=None):
+    """Run steps on every frame of an animated GIF or multi-page TIFF, FRAME_WORKERS at a time.
+
+    Returns (payload, mimetype, encode_seconds) in the input's format.
+    """
+    timing = current_timing()  # Frames run on threads outside the request context
+    return process_frames(image, lambda img_array: execute_steps(img_array, steps, timing), FRAME_WORKERS, progress)
+
+def busy_response():
+    """503 telling the client when to retry: the queue or memory budget is full, or a worker crashed."""
+    response = jsonify({"error": "Server busy, please retry shortly"})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(RETRY_AFTER_SECONDS)
+    return response
+
+def too_large_response(error, file_path=None):
+    """413 for an image that could never fit the memory budget; its upload is released."""
+    if file_path and upload_store.release(file_path):
+        print(f"Deleted uploaded file after rejecting it: {file_path}")
+    return jsonify({"error": str(error)}), 413
+
+def send_result(payload, mimetype, encode_seconds=0.0):
+    """Send an encoded result, reporting encode time and output size."""
+    current_timing().bytes_out = len(payload)
+    response = send_file(io.BytesIO(payload), mimetype=mimetype)
+    response.headers["X-Encode-Time-Ms"] = f"{encode_seconds * 1000:.1f}"
+    response.headers["X-Output-Bytes"] = str(len(payload))
+    return response
+
 @app.route("/")
 def home():
     return jsonify({"message": "Image Processing API Running!"})
@@ -53,18 +249,22 @@ def home():
 @app.route("/upload", methods=["POST"])
 def upload_image():
     """Upload an image and return its path."""
-    if "file" not in request.files:
+    timing = current_timing()
+    with timing.stage("upload_read"):
+        files = request.files
+    if "file" not in files:
         return jsonify({"error": "No file uploaded"}), 400
 
     file = request.files["file"]
     if not file.filename:
         return jsonify({"error": "No file selected"}), 400
-        
-    # Generate a unique filename to avoid collisions
-    timestamp = int(time.time())
-    filename = f"{timestamp}_{file.filename}"
-    file_path = os.path.join(UPLOAD_FOLDER, filename)
-    file.save(file_path)
+
+    # Named by content hash, so uploading the same image again reuses its file
+    with timing.stage("upload_write"):
+        try:
+            file_path = upload_store.put(file.read())
+        except UploadQuotaError as e:
+            return jsonify({"error": str(e)}), 413
 
     return jsonify({"message": "File uploaded", "file_path": file_path})
 
@@ -74,53 +274,322 @@ def process_image(operation):
     data = request.json
     file_path = data.get("file_path")
 
-    if not file_path or not os.path.exists(file_path):
+    if not file_path or not upload_store.contains(file_path):
         return jsonify({"error": "File not found"}), 400
 
+    if operation not in OPERATIONS:
+        return jsonify({"error": "Invalid operation"}), 400
+
+    # Operation parameters (e.g. "levels" for quantize) come from the same body
+    params = {key: data[key] for key in operation_parameters(OPERATIONS[operation]) if key in data}
     try:
-        image = Image.open(file_path)
-
-        # Apply the selected filter
-        if operation == "grayscale":
-            processed_img = convert_grayscale(image)
-        elif operation == "quantize":
-            processed_img = quantize_image(image, levels=4)
-        elif operation == "histogram":
-            processed_img = histogram_equalization(image)
-        elif operation == "smooth":
-            processed_img = smooth_filter(image)
-        elif operation == "sharpen":
-            processed_img = sharpen_filter(image)
-        elif operation == "highpass":
-            processed_img = high_pass_filter(image)
-        elif operation == "lowpass":
-            processed_img = low_pass_filter(image)
-        else:
-            return jsonify({"error": "Invalid operation"}), 400
+        steps = parse_steps([{"operation": operation, **params}], OPERATIONS)
+        # "preview": long-edge size for a quick reduced-resolution render
+        preview = parse_preview(data)
+        output = parse_output_options(data, preview=preview is not None)
+    except (PipelineError, EncodingError) as e:
+        return jsonify({"error": str(e)}), 400
 
-        # Save processed image in memory (not on disk)
-        img_io = io.BytesIO()
-        processed_img.save(img_io, format="PNG")
-        img_io.seek(0)
+    timing = current_timing()
+    timing.operation = operation
 
-        # Delete the uploaded image after processing
-        try:
-            os.remove(file_path)
+    try:
+        with timing.stage("read"):
+            upload_bytes = upload_store.read(file_path)
+        if upload_bytes is None:  # Expired or evicted since the check above
+            return jsonify({"error": "File not found"}), 400
+
+        payload, mimetype, encode_seconds = render_pipeline(
+            upload_bytes, steps, output, preview=preview, endpoint="process"
+        )
+
+        # Release the uploaded image after processing (deleted unless uploaded again meanwhile)
+        if upload_store.release(file_path):
             print(f"Deleted uploaded file: {file_path}")
-        except Exception as e:
-            print(f"Error deleting uploaded file: {e}")
 
-        return send_file(img_io, mimetype="image/png")
-    
+        return send_result(payload, mimetype, encode_seconds)
+
+    except (QueueFullError, MemoryBusyError, WorkerCrashedError):
+        # Keep the upload so the client can retry with the same file_path
+        return busy_response()
+    except ImageTooLargeError as e:
+        return too_large_response(e, file_path)
     except Exception as e:
-        # Make sure to delete the uploaded file even if processing fails
-        try:
-            os.remove(file_path)
+        # Make sure to release the uploaded file even if processing fails
+        if upload_store.release(file_path):
+            print(f"Deleted uploaded file after error: {file_path}")
+        return jsonify({"error": f"Processing error: {str(e)}"}), 500
+
+def render_pipeline(upload_bytes, steps, output=DEFAULT_OUTPUT, progress=None, preview=None, endpoint="pipeline"):
+    """Decode, run steps and encode, going through the result cache.
+
+    Returns (payload, mimetype, encode_seconds); encode_seconds is 0 on a
+    cache hit. With a progress callback the steps run one at a time and the
+    fraction completed is reported after each of them. With preview the
+    image is decoded and processed at that long-edge size. Every frame of
+    an animated GIF or multi-page TIFF is processed, and the result keeps
+    the input's format whatever output asks for; progress then counts
+    frames. Previews use the first frame only. endpoint keeps the cache
+    entries of different routes apart.
+    """
+    timing = current_timing()
+    if not timing.operation:
+        # One fixed label for every multi-step run keeps the metric series bounded
+        timing.operation = steps[0][0] if len(steps) == 1 else "pipeline"
+
+    cache_key = ResultCache.make_key(upload_bytes, steps, endpoint=endpoint, output=output, preview=preview)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        return cached + (0.0,)
+
+    with admitted(upload_bytes, steps, preview) as tiled:
+        with timing.stage("decode"):
+            image, scale = load_image(io.BytesIO(upload_bytes), preview)
+        timing.width, timing.height = image.size
+        if scale != 1.0:
+            steps = scale_steps(steps, OPERATIONS, scale)
+
+        if preview is None and is_multiframe(image):
+            # Frames are encoded as they are processed
+            with timing.stage("filter"):
+                payload, mimetype, encode_seconds = execute_frames(image, steps, progress)
+            result_cache.put(cache_key, payload, mimetype)
+            return payload, mimetype, encode_seconds
+
+        with timing.stage("filter"):
+            if tiled:
+                processed_array = execute_tiled(image, steps)
+            elif progress is None:
+                img_array = image_to_array(image)
+                processed_array = execute_steps(img_array, steps)
+            else:
+                processed_array = image_to_array(image)
+                for done, step in enumerate(steps, 1):
+                    previous, processed_array = processed_array, execute_steps(processed_array, [step])
+                    if processed_array is not previous:
+                        POOL.give(previous)
+                    progress(done / (len(steps) + 1))  # Leave the last share for encoding
+
+        with timing.stage("encode"):
+            # A tiled result is read back from its scratch file a strip at a time
+            rows = result_rows(processed_array, TILE_MEMORY_BUDGET) if tiled else None
+            payload, mimetype, encode_seconds = encode_array(processed_array, output, rows)
+        POOL.give(processed_array)  # Only the encoded bytes are kept
+    result_cache.put(cache_key, payload, mimetype)
+    return payload, mimetype, encode_seconds
+
+@app.route("/pipeline", methods=["POST"])
+def process_pipeline():
+    """Apply an ordered list of operations to an uploaded image in one pass.
+
+    The image is decoded once, every step works on the in-memory array and
+    only the final result is encoded (PNG unless "format" says otherwise).
+    """
+    data = request.json
+    file_path = data.get("file_path")
+
+    if not file_path or not upload_store.contains(file_path):
+        return jsonify({"error": "File not found"}), 400
+
+    try:
+        steps = parse_steps(data.get("operations"), OPERATIONS)
+        preview = parse_preview(data)
+        output = parse_output_options(data, preview=preview is not None)
+    except (PipelineError, EncodingError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with current_timing().stage("read"):
+            upload_bytes = upload_store.read(file_path)
+        if upload_bytes is None:  # Expired or evicted since the check above
+            return jsonify({"error": "File not found"}), 400
+
+        payload, mimetype, encode_seconds = render_pipeline(upload_bytes, steps, output, preview=preview)
+
+        # Release the uploaded image after processing (deleted unless uploaded again meanwhile)
+        if upload_store.release(file_path):
+            print(f"Deleted uploaded file: {file_path}")
+
+        return send_result(payload, mimetype, encode_seconds)
+
+    except (QueueFullError, MemoryBusyError, WorkerCrashedError):
+        # Keep the upload so the client can retry with the same file_path
+        return busy_response()
+    except ImageTooLargeError as e:
+        return too_large_response(e, file_path)
+    except Exception as e:
+        # Make sure to release the uploaded file even if processing fails
+        if upload_store.release(file_path):
             print(f"Deleted uploaded file after error: {file_path}")
-        except:
-            pass
         return jsonify({"error": f"Processing error: {str(e)}"}), 500
 
+@app.route("/process_upload", methods=["POST"])
+def process_upload():
+    """Upload and process an image in a single request.
+
+    Takes the multipart "file" plus "operation" or "operations" (JSON list)
+    and replies with the result; the image never touches uploads/.
+    """
+    with current_timing().stage("upload_read"):
+        files = request.files
+    if "file" not in files:
+        return jsonify({"error": "No file uploaded"}), 400
+
+    file = request.files["file"]
+    if not file.filename:
+        return jsonify({"error": "No file selected"}), 400
+
+    try:
+        steps = parse_form_steps(request.form, OPERATIONS)
+        preview = parse_preview(request.form)
+        output = parse_output_options(request.form, preview=preview is not None)
+    except (PipelineError, EncodingError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        return send_result(*render_pipeline(file.read(), steps, output, preview=preview))
+    except (QueueFullError, MemoryBusyError, WorkerCrashedError):
+        return busy_response()
+    except ImageTooLargeError as e:
+        return too_large_response(e)
+    except Exception as e:
+        return jsonify({"error": f"Processing error: {str(e)}"}), 500
+
+def render_when_ready(upload_bytes, steps, output=DEFAULT_OUTPUT, progress=None):
+    """render_pipeline for background work: wait up to JOB_MAX_WAIT for room in the pool and budget."""
+    deadline = time.monotonic() + JOB_MAX_WAIT
+    while True:
+        try:
+            return render_pipeline(upload_bytes, steps, output, progress)
+        except (QueueFullError, MemoryBusyError):
+            if time.monotonic() + RETRY_AFTER_SECONDS > deadline:
+                raise RuntimeError(f"Server stayed busy for {JOB_MAX_WAIT:g}s; submit the job again later")
+            time.sleep(RETRY_AFTER_SECONDS)
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """Queue processing in the background and return a job id.
+
+    Accepts either JSON {file_path, operations} for an already uploaded
+    file or a multipart "file" with "operation"/"operations" fields.
+    """
+    try:
+        if "file" in request.files:
+            file = request.files["file"]
+            if not file.filename:
+                return jsonify({"error": "No file selected"}), 400
+            steps = parse_form_steps(request.form, OPERATIONS)
+            output = parse_output_options(request.form)
+            upload_bytes = file.read()
+        else:
+            data = request.json
+            file_path = data.get("file_path")
+            if not file_path or not upload_store.contains(file_path):
+                return jsonify({"error": "File not found"}), 400
+            steps = parse_steps(data.get("operations"), OPERATIONS)
+            output = parse_output_options(data)
+            upload_bytes = upload_store.read(file_path)
+            if upload_bytes is None:
+                return jsonify({"error": "File not found"}), 400
+    except (PipelineError, EncodingError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        job_id = job_store.submit(render_when_ready, upload_bytes, steps, output)
+    except JobQueueFullError:
+        # Keep the upload so the client can retry with the same file_path
+        return busy_response()
+    # The job keeps its own copy of the bytes
+    if "file" not in request.files and upload_store.release(file_path):
+        print(f"Deleted uploaded file: {file_path}")
+    return jsonify({
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}",
+        "result_url": f"/jobs/{job_id}/result",
+    }), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """Report a job's status and progress."""
+    status = job_store.status(job_id)
+    if status is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(status)
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    """Return the processed image of a finished job."""
+    status = job_store.status(job_id)
+    if status is None:
+        return jsonify({"error": "Job not found"}), 404
+    if status["status"] == "failed":
+        return jsonify({"error": f"Processing error: {status['error']}"}), 500
+    if status["status"] != "done":
+        return jsonify(status), 202
+
+    return send_result(*job_store.result(job_id))
+
+@app.route("/batch", methods=["POST"])
+def process_batch():
+    """Apply the same operations to many images and stream back a ZIP.
+
+    Takes one or more multipart "files" (plain images and/or ZIP archives)
+    plus "operation" or "operations"; results are added to the response
+    archive as each image finishes.
+    """
+    files = request.files.getlist("files") + request.files.getlist("file")
+    if not files:
+        return jsonify({"error": "No file uploaded"}), 400
+
+    try:
+        steps = parse_form_steps(request.form, OPERATIONS)
+        output = parse_output_options(request.form)
+    except (PipelineError, EncodingError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Flask closes the request's files before the response is streamed
+    uploads = [(file.filename, file.read()) for file in files]
+    chunks = stream_batch(
+        iter_batch_inputs(uploads, BATCH_MAX_ENTRY_BYTES),
+        lambda upload_bytes: render_when_ready(upload_bytes, steps, output),
+        BATCH_WORKERS,
+    )
+    return Response(
+        stream_with_context(chunks),
+        mimetype="application/zip",
+        headers={"Content-Disposition": "attachment; filename=processed.zip"},
+    )
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Request counts, errors, latency histograms and bytes in Prometheus text format."""
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/operations", methods=["GET"])
+def list_operations():
+    """Describe every operation: kind, parameters with defaults and backends."""
+    return jsonify(describe_operations())
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """Report result cache size and hit/miss counters."""
+    return jsonify(result_cache.stats())
+
+@app.route("/admission/stats", methods=["GET"])
+def admission_stats():
+    """Report the memory budget, bytes reserved and admission counters."""
+    return jsonify(memory_budget.stats())
+
+@app.route("/buffers/stats", methods=["GET"])
+def buffer_stats():
+    """Report buffer pool size, reuse counters and bytes allocated so far."""
+    return jsonify(POOL.stats())
+
+@app.route("/uploads/stats", methods=["GET"])
+def upload_stats():
+    """Report stored uploads, bytes on disk against the quota and expiry/eviction counters."""
+    return jsonify(upload_store.stats())
+
 @app.route("/delete", methods=["POST"])
 def delete_file():
     """Delete a file from the server."""
@@ -130,12 +599,11 @@ def delete_file():
     if not file_name:
         return jsonify({"error": "No file path provided"}), 400
     
-    # For security, make sure we're only deleting from the uploads folder
-    file_path = os.path.join(UPLOAD_FOLDER, os.path.basename(file_name))
-    
+    # Only files in the upload store can be deleted; a file uploaded more
+    # than once stays until every upload of it is released
     try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        if upload_store.contains(file_name):
+            upload_store.release(file_name)
             return jsonify({"message": f"File {file_name} deleted"})
         else:
             return jsonify({"message": f"File {file_name} not found, may have been already deleted"})
@@ -146,10 +614,7 @@ def delete_file():
 def cleanup_all():
     """Admin endpoint to clean up all files in the uploads directory."""
     try:
-        for filename in os.listdir(UPLOAD_FOLDER):
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            if os.path.isfile(file_path):
-                os.remove(file_path)
+        upload_store.clear()
         return jsonify({"message": "All files cleaned up"})
     except Exception as e:
         return jsonify({"error": f"Cleanup failed: {str(e)}"}), 500
@@ -165,6 +630,9 @@ def cleanup_on_shutdown():
 # Register the cleanup function to run at exit
 import atexit
 atexit.register(cleanup_on_shutdown)
+atexit.register(job_store.shutdown)
+if processing_pool is not None:
+    atexit.register(processing_pool.shutdown)
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))  # Render assigns a dynamic PORT
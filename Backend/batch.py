@@ -0,0 +1,136 @@
+import io
+import mimetypes
+import os
+import posixpath
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class _ZipSink:
+    """Write-only file object that collects ZIP bytes until they are drained.
+
+    It has no seek(), so zipfile writes each entry with a trailing data
+    descriptor and never goes back to patch earlier bytes; everything
+    written so far can be sent to the client right away.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class EntryTooLargeError(ValueError):
+    """Raised for a ZIP entry that would decompress to more than the allowed size."""
+
+
+def _read_entry(archive, info, max_entry_bytes):
+    # ZipExtFile never returns more than the declared size, so checking it
+    # up front bounds the memory a small archive can expand into
+    if max_entry_bytes is not None and info.file_size > max_entry_bytes:
+        raise EntryTooLargeError(
+            f"Entry is {info.file_size} bytes uncompressed, over the {max_entry_bytes} byte limit"
+        )
+    return archive.read(info)
+
+
+def iter_batch_inputs(uploads, max_entry_bytes=None):
+    """Yield (name, read) for every image in [(filename, data), ...].
+
+    ZIP archives are expanded entry by entry; read() decompresses one
+    entry only when that image is about to be processed, and fails with
+    EntryTooLargeError for entries larger than max_entry_bytes.
+    """
+    for filename, data in uploads:
+        stream = io.BytesIO(data)
+        if zipfile.is_zipfile(stream):
+            archive = zipfile.ZipFile(stream)
+            for info in archive.infolist():
+                if info.is_dir() or info.filename.startswith("__MACOSX/"):
+                    continue
+                yield info.filename, (
+                    lambda info=info, archive=archive: _read_entry(archive, info, max_entry_bytes)
+                )
+        else:
+            yield filename, (lambda data=data: data)
+
+
+def safe_name(name):
+    """Relative archive path for a client-supplied name: no drive, root, "." or ".." parts."""
+    parts = posixpath.normpath(str(name).replace("\\", "/")).split("/")
+    parts = [part for part in parts if part not in ("", ".", "..") and not part.endswith(":")]
+    return "/".join(parts) or "image"
+
+
+def _output_name(name, mimetype, used):
+    """Name a result after its input, with the extension of the output format."""
+    base = os.path.splitext(name)[0] or "image"
+    extension = mimetypes.guess_extension(mimetype) or ""
+    candidate = f"{base}{extension}"
+    counter = 1
+    while candidate in used:
+        candidate = f"{base}_{counter}{extension}"
+        counter += 1
+    used.add(candidate)
+    return candidate
+
+
+def stream_batch(inputs, render, workers):
+    """Render inputs in parallel and yield a ZIP archive chunk by chunk.
+
+    render(upload_bytes) must return (payload, mimetype, ...). At most `workers`
+    images are decompressed and in flight at once and each finished image
+    is written out as soon as it completes, so the output archive is never
+    held in memory as a whole. An image that fails
+    gets a "<name>.error.txt" entry instead of aborting the batch.
+    """
+    sink = _ZipSink()
+    used_names = set()
+    inputs = iter(inputs)
+    pending = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+
+        def fill():
+            while len(pending) < workers:
+                item = next(inputs, None)
+                if item is None:
+                    return
+                name, read = item
+                pending[executor.submit(lambda read=read: render(read()))] = name
+
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = safe_name(pending.pop(future))  # Never write zip-slip paths back out
+                try:
+                    payload, mimetype = future.result()[:2]
+                    archive.writestr(_output_name(name, mimetype, used_names), payload)
+                except Exception as e:
+                    print(f"Batch item {name} failed: {e}")
+                    archive.writestr(f"{name}.error.txt", f"Processing error: {e}")
+            fill()
+
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+
+    # Central directory, written when the archive is closed
+    yield sink.drain()
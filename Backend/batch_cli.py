@@ -0,0 +1,271 @@
+"""Run a pipeline over a directory of images, without the web server.
+
+Every image under INPUT_DIR (recursively) goes through the operations with
+the chosen backend, on a pool of worker processes, and the result is
+written under OUTPUT_DIR at the same relative path with the output
+format's extension:
+
+    python batch_cli.py photos/ out/ --operations '["grayscale", {"operation": "quantize", "levels": 8}]'
+    python batch_cli.py scans/ out/ --operations sharpen,clahe --backend localprocessing --format webp
+
+Finished files are recorded in a manifest (OUTPUT_DIR/manifest.jsonl by
+default), so running the same command again after an interruption skips
+them and only processes what is left or failed. A file is processed again
+if it changed or the operations or output settings differ.
+"""
+import argparse
+import hashlib
+import importlib
+import json
+import mimetypes
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from collections import Counter
+
+from PIL import Image
+
+from buffers import POOL
+from encoding import EncodingError, encode_array, parse_output_options
+from frames import is_multiframe, process_frames
+from pipeline import PipelineError, image_to_array, parse_steps
+from registry import run_plan
+
+BACKENDS = ("processing", "localprocessing")
+
+# Extensions for mimetypes the mimetypes module does not know
+EXTENSIONS = {"application/x-npy": ".npy", "image/webp": ".webp"}
+
+_backend = None  # Set in each worker by _init_worker
+
+
+def _init_worker(backend, threads):
+    global _backend
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C is handled once, by the parent
+    _backend = backend
+    module = importlib.import_module(backend)
+    if hasattr(module, "set_thread_count"):
+        module.set_thread_count(threads)
+    if hasattr(module, "cv2"):
+        module.cv2.setNumThreads(threads)  # The pool already keeps every core busy
+
+
+def image_extensions():
+    """Lowercase file extensions Pillow can open."""
+    return {ext for ext, fmt in Image.registered_extensions().items() if fmt in Image.OPEN}
+
+
+def find_images(input_dir, skip_dir=None):
+    """Yield image paths relative to input_dir, in sorted order, skipping skip_dir."""
+    extensions = image_extensions()
+    skip_dir = os.path.abspath(skip_dir) if skip_dir else None
+    for root, dirs, files in os.walk(input_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) != skip_dir)
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in extensions:
+                yield os.path.relpath(os.path.join(root, name), input_dir)
+
+
+def spec_digest(steps, output, backend):
+    """Short hash of everything that decides the output, stored with each manifest entry."""
+    spec = json.dumps({"steps": steps, "output": output, "backend": backend}, sort_keys=True)
+    return hashlib.sha256(spec.encode()).hexdigest()[:16]
+
+
+def _output_extension(mimetype):
+    return EXTENSIONS.get(mimetype) or mimetypes.guess_extension(mimetype) or ""
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_manifest(path):
+    """{input: entry} of the latest entry per input; a torn last line is ignored."""
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            entries[entry["input"]] = entry
+    return entries
+
+
+def is_done(entry, input_path, output_dir, digest):
+    """Whether a manifest entry says this input was already processed as now requested."""
+    if entry is None or entry.get("status") != "done" or entry.get("spec") != digest:
+        return False
+    if [entry.get("size"), entry.get("mtime_ns")] != list(_signature(input_path)):
+        return False
+    return os.path.exists(os.path.join(output_dir, entry["output"]))
+
+
+def _ends_torn(path):
+    """Whether a file ends in an incomplete line."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        if not f.tell():
+            return False
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+
+def _write_atomic(path, payload):
+    """Write via a temporary file so an interrupted run never leaves a partial output."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.part"
+    with open(temp_path, "wb") as f:
+        f.write(payload)
+    os.replace(temp_path, path)
+
+
+def process_file(task):
+    """Worker: decode, run the steps, encode and write one image; return its manifest entry."""
+    input_dir, output_dir, relative, stem, steps, output, digest = task
+    input_path = os.path.join(input_dir, relative)
+    start = time.perf_counter()
+    entry = {"input": relative, "spec": digest}
+    try:
+        size, mtime_ns = _signature(input_path)
+        entry.update({"size": size, "mtime_ns": mtime_ns})
+        plan = [(_backend, steps)]
+        with Image.open(input_path) as image:
+            image.load()
+            megapixels = image.width * image.height / 1e6
+            if is_multiframe(image):
+                megapixels *= image.n_frames
+                payload, mimetype, _ = process_frames(image, lambda img_array: run_plan(img_array, plan), 1)
+            else:
+                processed_array = run_plan(image_to_array(image), plan)
+                payload, mimetype, _ = encode_array(processed_array, output)
+                POOL.give(processed_array)
+
+        output_relative = stem + _output_extension(mimetype)
+        _write_atomic(os.path.join(output_dir, output_relative), payload)
+        entry.update({
+            "status": "done", "output": output_relative, "megapixels": round(megapixels, 4),
+            "output_bytes": len(payload),
+        })
+    except Exception as e:
+        entry.update({"status": "failed", "error": str(e)})
+    entry["seconds"] = round(time.perf_counter() - start, 4)
+    return entry
+
+
+def run_batch(input_dir, output_dir, steps, output, backend, workers, threads=1, manifest_path=None, verbose=True):
+    """Process every image under input_dir not already done; return a summary dict."""
+    manifest_path = manifest_path or os.path.join(output_dir, "manifest.jsonl")
+    digest = spec_digest(steps, output, backend)
+    previous = load_manifest(manifest_path)
+
+    inputs = list(find_images(input_dir, skip_dir=output_dir))
+    # Outputs are named after the input minus its extension, unless that
+    # would collide (photo.jpg and photo.png both becoming photo.png)
+    stems = [os.path.splitext(relative)[0] for relative in inputs]
+    stem_counts = Counter(stems)
+    tasks = []
+    skipped = 0
+    for relative, stem in zip(inputs, stems):
+        if is_done(previous.get(relative), os.path.join(input_dir, relative), output_dir, digest):
+            skipped += 1
+        else:
+            stem = relative if stem_counts[stem] > 1 else stem
+            tasks.append((input_dir, output_dir, relative, stem, steps, output, digest))
+
+    os.makedirs(output_dir, exist_ok=True)
+    summary = {"processed": 0, "failed": 0, "skipped": skipped, "megapixels": 0.0, "interrupted": False}
+    start = time.perf_counter()
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(backend, threads))
+    try:
+        with open(manifest_path, "a") as manifest:
+            if _ends_torn(manifest_path):
+                manifest.write("\n")  # Keep a line torn by a crash from swallowing the next one
+            for done, entry in enumerate(pool.imap_unordered(process_file, tasks), 1):
+                # One line per finished file, on disk before the next is counted
+                manifest.write(json.dumps(entry) + "\n")
+                manifest.flush()
+                os.fsync(manifest.fileno())
+
+                if entry["status"] == "done":
+                    summary["processed"] += 1
+                    summary["megapixels"] += entry["megapixels"]
+                else:
+                    summary["failed"] += 1
+                    print(f"Failed {entry['input']}: {entry['error']}")
+                if verbose:
+                    print(f"[{done}/{len(tasks)}] {entry['input']} {entry['status']} in {entry['seconds']:.2f}s")
+        pool.close()
+    except KeyboardInterrupt:
+        summary["interrupted"] = True
+        pool.terminate()
+    finally:
+        pool.join()
+
+    summary["seconds"] = time.perf_counter() - start
+    seconds = summary["seconds"] or 1e-9
+    summary["images_per_s"] = summary["processed"] / seconds
+    summary["mp_per_s"] = summary["megapixels"] / seconds
+    return summary
+
+
+def parse_operations(text):
+    """A JSON operation list, or comma-separated operation names."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return [name.strip() for name in text.split(",") if name.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_dir", help="directory of images to process (searched recursively)")
+    parser.add_argument("output_dir", help="where results are written, mirroring input_dir")
+    parser.add_argument("--operations", required=True,
+                        help="JSON list of steps as for /pipeline, or comma-separated operation names")
+    parser.add_argument("--backend", default=BACKENDS[0], choices=BACKENDS, help="operations module to use")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="threads per worker: row bands for localprocessing, OpenCV's own for processing")
+    parser.add_argument("--format", default="png", help="output format: png, webp, jpeg or raw")
+    parser.add_argument("--quality", type=int, help="JPEG/WebP quality (1-100)")
+    parser.add_argument("--compress-level", type=int, help="PNG zlib level (0-9)")
+    parser.add_argument("--manifest", help="manifest path (default: OUTPUT_DIR/manifest.jsonl)")
+    parser.add_argument("--quiet", action="store_true", help="only print failures and the summary")
+    args = parser.parse_args(argv)
+
+    module = importlib.import_module(args.backend)
+    values = {"format": args.format, "quality": args.quality, "compress_level": args.compress_level}
+    try:
+        steps = parse_steps(parse_operations(args.operations), module.OPERATIONS)
+        output = parse_output_options({key: value for key, value in values.items() if value is not None})
+    except (PipelineError, EncodingError) as e:
+        print(f"Error: {e}")
+        return 2
+    if not os.path.isdir(args.input_dir):
+        print(f"Error: {args.input_dir} is not a directory")
+        return 2
+
+    summary = run_batch(
+        args.input_dir, args.output_dir, steps, output, args.backend, max(args.workers, 1),
+        args.threads, args.manifest, verbose=not args.quiet,
+    )
+    print(
+        f"Processed {summary['processed']} images ({summary['megapixels']:.1f} MP) in {summary['seconds']:.1f}s: "
+        f"{summary['images_per_s']:.2f} images/s, {summary['mp_per_s']:.2f} MP/s; "
+        f"{summary['skipped']} already done, {summary['failed']} failed"
+    )
+    if summary["interrupted"]:
+        print("Interrupted; run the same command again to resume")
+        return 130
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""Benchmark processing.py (OpenCV) against localprocessing.py (NumPy).
+
+Generates synthetic grayscale, RGB and RGBA images, times decode, filter
+and encode for every operation in both backends, checks that the two
+backends agree and writes everything to JSON for later comparison:
+
+    python benchmark.py --sizes 512x512,2048x1536 --output bench.json
+    python benchmark.py --baseline bench.json --output bench_new.json
+"""
+import argparse
+import importlib
+import io
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+from encoding import encode_array
+from pipeline import decode_image
+
+BACKENDS = ("processing", "localprocessing")
+MODES = ("L", "RGB", "RGBA")
+DEFAULT_SIZES = "256x256,1024x768,2048x1536"
+
+
+def synthetic_image(width, height, mode, seed=0):
+    """Deterministic test image: smooth gradients plus noise and hard edges."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    channels = []
+    for c in range(len(mode)):
+        gradient = (x * (c + 1) * 255.0 / max(width, 1) + y * 128.0 / max(height, 1)) % 256
+        blocks = ((x // 32 + y // 32 + c) % 2) * 40
+        noise = rng.normal(0, 12, size=(height, width))
+        channels.append(np.clip(gradient + blocks + noise, 0, 255).astype(np.uint8))
+    if mode == "RGBA":
+        channels[3] = np.full((height, width), 255, dtype=np.uint8)
+    pixels = channels[0] if mode == "L" else np.dstack(channels)
+    return Image.fromarray(pixels, mode)
+
+
+def load_backends(names):
+    """Import the requested backends, skipping any whose dependencies are missing."""
+    backends = {}
+    for name in names:
+        try:
+            backends[name] = importlib.import_module(name)
+        except ImportError as e:
+            print(f"Skipping {name}: {e}")
+    return backends
+
+
+def _timed(func, repeat):
+    """Run func repeat times; return (median seconds, last result)."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def _peak_memory(func):
+    """Peak bytes allocated through Python/NumPy while func runs.
+
+    Memory OpenCV allocates internally is not visible to tracemalloc, so
+    this understates the cost of the OpenCV backend.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmarks(backends, sizes, modes, operations, repeat, measure_memory=True, verbose=True):
+    """Time every backend/operation/mode/size and collect the filter outputs."""
+    results = []
+    outputs = {}
+    for width, height in sizes:
+        megapixels = width * height / 1e6
+        for mode in modes:
+            png = io.BytesIO()
+            synthetic_image(width, height, mode).save(png, format="PNG")
+            png_bytes = png.getvalue()
+
+            decode_s, img_array = _timed(lambda: decode_image(io.BytesIO(png_bytes)), repeat)
+
+            for backend_name, module in backends.items():
+                for operation in operations:
+                    record = {
+                        "backend": backend_name, "operation": operation, "mode": mode,
+                        "width": width, "height": height, "decode_s": decode_s,
+                    }
+                    func = module.OPERATIONS.get(operation)
+                    if func is None:
+                        record["error"] = "not implemented"
+                        results.append(record)
+                        continue
+                    try:
+                        filter_s, processed = _timed(lambda: func(img_array), repeat)
+                        encode_s, _ = _timed(lambda: encode_array(processed), repeat)
+                        record.update({
+                            "filter_s": filter_s,
+                            "encode_s": encode_s,
+                            "total_s": decode_s + filter_s + encode_s,
+                            "mp_per_s": megapixels / filter_s if filter_s else None,
+                            "peak_bytes": _peak_memory(lambda: func(img_array)) if measure_memory else None,
+                        })
+                        outputs[(backend_name, operation, mode, width, height)] = processed
+                    except Exception as e:
+                        record["error"] = str(e)
+                    results.append(record)
+                    if verbose:
+                        print(_format_record(record))
+    return results, outputs
+
+
+def compare_backends(outputs, tolerance):
+    """Mean/max absolute difference between the two backends' outputs."""
+    agreement = []
+    for (backend, operation, mode, width, height), first in outputs.items():
+        if backend != BACKENDS[0]:
+            continue
+        second = outputs.get((BACKENDS[1], operation, mode, width, height))
+        if second is None:
+            continue
+        entry = {"operation": operation, "mode": mode, "width": width, "height": height}
+        if first.shape != second.shape:
+            entry.update({"within_tolerance": False, "error": f"shape {first.shape} != {second.shape}"})
+        else:
+            diff = np.abs(first.astype(np.int16) - second.astype(np.int16))
+            mean_diff = float(diff.mean())
+            entry.update({
+                "mean_abs_diff": mean_diff,
+                "max_abs_diff": int(diff.max()),
+                "within_tolerance": mean_diff <= tolerance,
+            })
+        agreement.append(entry)
+    return agreement
+
+
+def compare_to_baseline(results, baseline, threshold):
+    """Return records whose filter time regressed by more than threshold."""
+    def key(record):
+        return (record["backend"], record["operation"], record["mode"], record["width"], record["height"])
+
+    previous = {key(r): r for r in baseline.get("results", []) if "filter_s" in r}
+    regressions = []
+    for record in results:
+        old = previous.get(key(record))
+        if old is None or "filter_s" not in record:
+            continue
+        ratio = record["filter_s"] / old["filter_s"] if old["filter_s"] else 1.0
+        record["baseline_ratio"] = ratio
+        if ratio > 1 + threshold:
+            regressions.append(record)
+    return regressions
+
+
+def _format_record(record):
+    label = f"{record['backend']:>15} {record['operation']:>10} {record['mode']:>4} {record['width']}x{record['height']}"
+    if "error" in record:
+        return f"{label}  error: {record['error']}"
+    return (
+        f"{label}  decode {record['decode_s'] * 1000:8.1f} ms  filter {record['filter_s'] * 1000:8.1f} ms"
+        f"  encode {record['encode_s'] * 1000:8.1f} ms  {record['mp_per_s']:8.1f} MP/s"
+        f"  peak {record['peak_bytes'] / 2**20:7.1f} MB"
+    )
+
+
+def parse_sizes(text):
+    sizes = []
+    for item in text.split(","):
+        width, height = item.lower().split("x")
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated WxH list")
+    parser.add_argument("--modes", default=",".join(MODES), help="comma-separated image modes")
+    parser.add_argument("--operations", default="", help="comma-separated operations (default: all)")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="comma-separated backend modules")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="row-band threads for backends that support them (localprocessing)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (median is kept)")
+    parser.add_argument("--tolerance", type=float, default=2.0,
+                        help="max mean absolute difference for the backends to count as agreeing")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to write the JSON results")
+    parser.add_argument("--baseline", help="previous results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed filter-time slowdown versus the baseline (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    backends = load_backends(args.backends.split(","))
+    if not backends:
+        print("No backend could be imported")
+        return 2
+
+    for module in backends.values():
+        if hasattr(module, "set_thread_count"):
+            module.set_thread_count(args.threads)
+
+    operations = [op for op in args.operations.split(",") if op]
+    if not operations:
+        operations = sorted({op for module in backends.values() for op in module.OPERATIONS})
+
+    results, outputs = run_benchmarks(
+        backends, parse_sizes(args.sizes), args.modes.split(","), operations, args.repeat
+    )
+    agreement = compare_backends(outputs, args.tolerance)
+    for entry in agreement:
+        if not entry["within_tolerance"]:
+            detail = entry.get("error") or f"mean diff {entry['mean_abs_diff']:.2f}, max {entry['max_abs_diff']}"
+            print(f"Backends disagree on {entry['operation']} {entry['mode']} "
+                  f"{entry['width']}x{entry['height']}: {detail}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.threshold)
+        for record in regressions:
+            print(f"Regression: {_format_record(record)} ({record['baseline_ratio']:.2f}x baseline)")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "threads": args.threads,
+            "tolerance": args.tolerance,
+        },
+        "results": results,
+        "agreement": agreement,
+    }
+    if "processing" in backends:
+        report["meta"]["opencv"] = backends["processing"].cv2.__version__
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
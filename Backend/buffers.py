@@ -0,0 +1,128 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Idle bytes kept for reuse unless the app sets its own limit. Every process
+# has its own pool, so this is multiplied by workers and pool children.
+DEFAULT_POOL_BYTES = 64 * 1024 * 1024  # 64MB
+
+
+class BufferPool:
+    """Reusable scratch arrays keyed by shape and dtype, bounded by idle bytes.
+
+    Large arrays are expensive to allocate: every fresh one is mapped and
+    faulted in page by page. The operations take() their outputs and scratch
+    space from here, and whoever ends up holding an array gives it back once
+    nothing refers to it, so the next request with the same image size gets
+    warm memory instead. Idle arrays beyond max_bytes are dropped, least
+    recently returned sizes first.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_POOL_BYTES):
+        self.max_bytes = max_bytes
+        self.idle_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.allocated_bytes = 0
+        self.reused_bytes = 0
+        self._idle = OrderedDict()  # (shape, dtype) -> [array, ...]
+        self._lock = threading.Lock()
+
+    def take(self, shape, dtype=np.uint8):
+        """An array of this shape and dtype with arbitrary contents."""
+        shape = tuple(int(n) for n in shape)
+        dtype = np.dtype(dtype)
+        key = (shape, dtype.str)
+        with self._lock:
+            arrays = self._idle.get(key)
+            if arrays:
+                array = arrays.pop()
+                if not arrays:
+                    del self._idle[key]
+                self.idle_bytes -= array.nbytes
+                self.hits += 1
+                self.reused_bytes += array.nbytes
+                return array
+            self.misses += 1
+        array = np.empty(shape, dtype=dtype)
+        with self._lock:
+            self.allocated_bytes += array.nbytes
+        return array
+
+    def take_like(self, array):
+        return self.take(array.shape, array.dtype)
+
+    def give(self, *arrays):
+        """Return arrays nothing else refers to any more.
+
+        Only plain, C-contiguous, writeable arrays that own their memory are
+        kept, so views, memory maps and read-only decoder buffers handed in
+        by mistake are simply ignored.
+        """
+        for array in arrays:
+            if (
+                type(array) is not np.ndarray or array.base is not None or array.nbytes == 0
+                or not array.flags.c_contiguous or not array.flags.writeable
+                or array.nbytes > self.max_bytes
+            ):
+                continue
+            key = (array.shape, array.dtype.str)
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if any(other is array for other in idle):  # Given back twice
+                    continue
+                idle.append(array)
+                self._idle.move_to_end(key)
+                self.idle_bytes += array.nbytes
+                self._trim()
+
+    def resize(self, max_bytes):
+        """Change the idle limit, dropping arrays that no longer fit."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._trim()
+
+    def _trim(self):
+        while self.idle_bytes > self.max_bytes:
+            key, arrays = next(iter(self._idle.items()))
+            self.idle_bytes -= arrays.pop(0).nbytes
+            if not arrays:
+                del self._idle[key]
+
+    def clear(self):
+        with self._lock:
+            self._idle.clear()
+            self.idle_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            takes = self.hits + self.misses
+            return {
+                "idle_arrays": sum(len(arrays) for arrays in self._idle.values()),
+                "idle_bytes": self.idle_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "allocated_bytes": self.allocated_bytes,
+                "reused_bytes": self.reused_bytes,
+                "hit_rate": self.hits / takes if takes else 0.0,
+            }
+
+
+# Shared by both backends and every request in the process
+POOL = BufferPool()
+
+
+def _clear_in_child():
+    POOL._lock.release()
+    # The parent's idle arrays are shared copy-on-write; reusing them would
+    # copy every page into the child, so it starts with an empty pool
+    POOL.clear()
+
+
+# The process pool forks its workers from a process that is already running
+# request threads; holding the lock across fork() keeps a child from
+# inheriting it locked (and the idle lists half updated)
+os.register_at_fork(before=POOL._lock.acquire, after_in_parent=POOL._lock.release, after_in_child=_clear_in_child)
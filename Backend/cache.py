@@ -0,0 +1,81 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """In-process LRU cache of encoded results, bounded by total bytes.
+
+    Keys are derived from the hash of the uploaded bytes plus the operation
+    list, so re-running a filter on the same photo skips decode, filtering
+    and encoding entirely.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(data, steps, **options):
+        """Build a cache key from upload bytes and [(operation, params), ...].
+
+        Extra keyword options (endpoint, output settings, ...) become part of
+        the key so results that differ only in those are cached separately.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        spec = json.dumps(
+            {"steps": [[name, params] for name, params in steps], "options": options},
+            sort_keys=True,
+        )
+        return f"{digest}:{spec}"
+
+    def get(self, key):
+        """Return (payload, mimetype) for key, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, payload, mimetype):
+        """Store an encoded result, evicting least recently used entries."""
+        size = len(payload)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= len(self._entries.pop(key)[0])
+            self._entries[key] = (payload, mimetype)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
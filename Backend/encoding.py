@@ -0,0 +1,177 @@
+import io
+import struct
+import time
+import zlib
+
+import numpy as np
+from PIL import Image
+
+# Output format -> mimetype. "raw" is the .npy serialization of the result
+# array (shape and dtype header plus the pixel bytes) for internal callers.
+OUTPUT_FORMATS = {
+    "png": "image/png",
+    "webp": "image/webp",
+    "jpeg": "image/jpeg",
+    "raw": "application/x-npy",
+}
+
+# Defaults favour latency: zlib level 1 is several times faster than
+# Pillow's default of 6 for a few percent larger files, and WebP method 0
+# is the quickest encoder effort
+DEFAULT_PNG_COMPRESS_LEVEL = 1
+DEFAULT_QUALITY = 85
+DEFAULT_WEBP_METHOD = 0
+
+
+class EncodingError(ValueError):
+    """Raised for unknown output formats or out-of-range settings."""
+
+
+def _int_option(values, key, default, low, high):
+    value = values.get(key, default)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise EncodingError(f"{key} must be an integer")
+    if not low <= value <= high:
+        raise EncodingError(f"{key} must be between {low} and {high}")
+    return value
+
+
+def _bool_option(values, key, default):
+    value = values.get(key, default)
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def parse_output_options(values, preview=False):
+    """Read output settings from a JSON body or form and return a canonical dict.
+
+    Recognised keys: format (png, webp, jpeg/jpg, raw), compress_level
+    (PNG, 0-9), quality (JPEG/WebP, 1-100), lossless and method (WebP).
+    Only settings relevant to the chosen format are kept, so the dict can
+    be used as part of a cache key. Previews default to JPEG, the quickest
+    to encode and send, instead of PNG.
+    """
+    values = values or {}
+    fmt = str(values.get("format") or ("jpeg" if preview else "png")).lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in OUTPUT_FORMATS:
+        raise EncodingError(f"Unsupported output format: {fmt}")
+
+    options = {"format": fmt}
+    if fmt == "png":
+        options["compress_level"] = _int_option(values, "compress_level", DEFAULT_PNG_COMPRESS_LEVEL, 0, 9)
+    elif fmt == "jpeg":
+        options["quality"] = _int_option(values, "quality", DEFAULT_QUALITY, 1, 100)
+    elif fmt == "webp":
+        options["lossless"] = _bool_option(values, "lossless", False)
+        options["quality"] = _int_option(values, "quality", DEFAULT_QUALITY, 1, 100)
+        options["method"] = _int_option(values, "method", DEFAULT_WEBP_METHOD, 0, 6)
+    return options
+
+
+DEFAULT_OUTPUT = parse_output_options({})
+
+# PNG colour type by number of channels
+PNG_COLOR_TYPES = {1: 0, 3: 2, 4: 6}
+
+
+def _strips(img_array, rows):
+    for top in range(0, img_array.shape[0], rows):
+        yield np.asarray(img_array[top:top + rows])
+
+
+def _is_gray(img_array, rows=None):
+    """True for a 3-channel array whose channels are all identical, checked rows at a time."""
+    if len(img_array.shape) != 3 or img_array.shape[2] != 3:
+        return False
+    return all(
+        np.array_equal(block[:, :, 0], block[:, :, 1]) and np.array_equal(block[:, :, 1], block[:, :, 2])
+        for block in _strips(img_array, rows or max(img_array.shape[0], 1))
+    )
+
+
+def _png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def encode_png_strips(img_array, compress_level, rows):
+    """Write an 8-bit 1, 3 or 4 channel array as PNG, rows rows at a time.
+
+    Only one strip and the compressed output are in memory, so a
+    memory-mapped result is never copied whole. Every row uses the Up
+    filter: the bytes differ from Pillow's, the pixels do not.
+    """
+    height, width = img_array.shape[:2]
+    channels = img_array.shape[2] if img_array.ndim == 3 else 1
+    header = struct.pack(">IIBBBBB", width, height, 8, PNG_COLOR_TYPES[channels], 0, 0, 0)
+    chunks = [b"\x89PNG\r\n\x1a\n", _png_chunk(b"IHDR", header)]
+
+    compressor = zlib.compressobj(compress_level)
+    previous = np.zeros(width * channels, np.uint8)
+    for block in _strips(img_array, rows):
+        block = block.reshape(block.shape[0], -1)
+        filtered = np.empty((block.shape[0], block.shape[1] + 1), np.uint8)
+        filtered[:, 0] = 2  # Up: each byte minus the one above it, modulo 256
+        np.subtract(block[:1], previous, out=filtered[:1, 1:])
+        np.subtract(block[1:], block[:-1], out=filtered[1:, 1:])
+        previous = block[-1].copy()
+        data = compressor.compress(filtered)
+        if data:
+            chunks.append(_png_chunk(b"IDAT", data))
+    chunks.append(_png_chunk(b"IDAT", compressor.flush()))
+    chunks.append(_png_chunk(b"IEND", b""))
+    return b"".join(chunks)
+
+
+def encode_image(image, options=DEFAULT_OUTPUT):
+    """Encode a PIL image; return (payload, mimetype, encode_seconds)."""
+    start = time.perf_counter()
+    fmt = options["format"]
+    buffer = io.BytesIO()
+
+    if fmt == "raw":
+        np.save(buffer, np.asarray(image), allow_pickle=False)
+    elif fmt == "png":
+        image.save(buffer, format="PNG", compress_level=options["compress_level"])
+    elif fmt == "jpeg":
+        if image.mode not in ("L", "RGB"):
+            image = image.convert("RGB")  # JPEG has no alpha channel
+        image.save(buffer, format="JPEG", quality=options["quality"])
+    elif fmt == "webp":
+        image.save(
+            buffer, format="WEBP", lossless=options["lossless"],
+            quality=options["quality"], method=options["method"],
+        )
+
+    return buffer.getvalue(), OUTPUT_FORMATS[fmt], time.perf_counter() - start
+
+
+def encode_array(img_array, options=DEFAULT_OUTPUT, rows=None):
+    """Encode an ndarray; return (payload, mimetype, encode_seconds).
+
+    Grayscale results are always written single-channel, including color
+    arrays whose three channels turned out identical. With rows (for
+    memory-mapped tiled results) the array is read that many rows at a
+    time and PNG is written strip by strip; the other formats still need
+    one in-memory copy of the image for Pillow.
+    """
+    if _is_gray(img_array, rows):
+        img_array = img_array[:, :, 0]
+
+    channels = img_array.shape[2] if img_array.ndim == 3 else 1
+    if rows is not None and options["format"] == "png" and img_array.dtype == np.uint8 and channels in PNG_COLOR_TYPES:
+        start = time.perf_counter()
+        payload = encode_png_strips(img_array, options["compress_level"], rows)
+        return payload, OUTPUT_FORMATS["png"], time.perf_counter() - start
+
+    if options["format"] == "raw":
+        start = time.perf_counter()
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(img_array), allow_pickle=False)
+        return buffer.getvalue(), OUTPUT_FORMATS["raw"], time.perf_counter() - start
+
+    return encode_image(Image.fromarray(img_array), options)
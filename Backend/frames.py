@@ -0,0 +1,144 @@
+import io
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageSequence, TiffImagePlugin
+
+from buffers import POOL
+from pipeline import image_to_array
+
+# Multi-frame input formats -> mimetype of the output, which keeps the format
+MULTI_FRAME_FORMATS = {"GIF": "image/gif", "TIFF": "image/tiff"}
+
+# TIFF compressions that work for any frame mode; the rest (the fax codecs
+# need 1-bit images, JPEG cannot store alpha) are written as deflate
+TIFF_COMPRESSIONS = ("raw", "tiff_lzw", "tiff_deflate", "tiff_adobe_deflate", "packbits")
+
+
+def is_multiframe(image):
+    """Whether an opened image is an animated GIF or a multi-page TIFF."""
+    return image.format in MULTI_FRAME_FORMATS and getattr(image, "n_frames", 1) > 1
+
+
+def iter_frames(image):
+    """Yield (array, info) for every frame, decoding one frame at a time.
+
+    GIF frames come back fully composited, so each array is a complete
+    picture; info keeps the frame's duration and disposal method.
+    """
+    for frame in ImageSequence.Iterator(image):
+        info = {
+            "duration": frame.info.get("duration"),
+            "disposal": getattr(frame, "disposal_method", 0),
+        }
+        yield image_to_array(frame), info
+
+
+def map_frames(frames, func, workers):
+    """Yield (func(array), info) for (array, info) frames, in order, workers at a time.
+
+    Frames are pulled from the iterator only as earlier ones finish, so
+    about `workers` frames are decoded or in flight at once however long
+    the sequence is.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for array, info in frames:
+            pending.append((executor.submit(func, array), info))
+            if len(pending) >= workers:
+                future, info = pending.popleft()
+                yield future.result(), info
+        while pending:
+            future, info = pending.popleft()
+            yield future.result(), info
+
+
+def _images(frames, on_frame):
+    """PIL images over processed frames; each array goes back to the pool when the next is asked for."""
+    previous = None
+    for array, info in frames:
+        if previous is not None:
+            POOL.give(previous)
+        image = Image.fromarray(array)
+        if info.get("duration") is not None:
+            image.info["duration"] = info["duration"]
+        on_frame(info)
+        yield image
+        previous = array
+    if previous is not None:
+        POOL.give(previous)
+
+
+class _Disposals(list):
+    """Per-frame GIF disposal methods, filled in as frames arrive.
+
+    The writer reads entry i only once it has frame i. When every frame
+    turns out identical it writes a single frame instead and reads the
+    setting as one number, hence __int__.
+    """
+
+    def __int__(self):
+        return int(self[0]) if self else 0
+
+
+def _write_gif(images, buffer, source_info):
+    disposal = _Disposals()
+    images = _images(images, lambda info: disposal.append(info["disposal"]))
+    # The writer falls back to the first image itself when every frame turns
+    # out identical, by which time its array may be back in the pool
+    first = next(images).copy()
+    options = {"loop": source_info["loop"]} if "loop" in source_info else {}
+    first.save(buffer, format="GIF", save_all=True, append_images=images, disposal=disposal, **options)
+
+
+def _write_tiff(images, buffer, source_info):
+    compression = source_info.get("compression")
+    if compression not in TIFF_COMPRESSIONS:
+        compression = "tiff_deflate"
+    # Written page by page: save_all would first collect every frame in a list
+    with TiffImagePlugin.AppendingTiffWriter(buffer, new=True) as tiff:
+        for image in _images(images, lambda info: None):
+            image.save(tiff, format="TIFF", compression=compression)
+            tiff.newFrame()
+
+
+def process_frames(image, func, workers, progress=None):
+    """Run func on every frame of a multi-frame image and encode the result.
+
+    Frames are decoded, processed `workers` at a time and handed to the
+    encoder one by one. The output has the input's format, frame timing,
+    disposal and loop count. progress, if given, receives the fraction of
+    frames written. Returns (payload, mimetype, encode_seconds).
+    """
+    count = image.n_frames
+    source_info = {"loop": image.info["loop"]} if "loop" in image.info else {}
+    if "compression" in image.info:
+        source_info["compression"] = image.info["compression"]
+
+    waited = 0.0  # Time the encoder spent waiting for frames to be processed
+    written = 0
+
+    def timed(frames):
+        nonlocal waited, written
+        frames = iter(frames)
+        while True:
+            start = time.perf_counter()
+            item = next(frames, None)
+            waited += time.perf_counter() - start
+            if item is None:
+                return
+            written += 1
+            if progress is not None:
+                progress(written / (count + 1))
+            yield item
+
+    buffer = io.BytesIO()
+    start = time.perf_counter()
+    frames = timed(map_frames(iter_frames(image), func, workers))
+    if image.format == "GIF":
+        _write_gif(frames, buffer, source_info)
+    else:
+        _write_tiff(frames, buffer, source_info)
+    encode_seconds = time.perf_counter() - start - waited
+    return buffer.getvalue(), MULTI_FRAME_FORMATS[image.format], encode_seconds
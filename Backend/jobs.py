@@ -0,0 +1,136 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobQueueFullError(RuntimeError):
+    """Raised when the store already has its maximum number of queued and running jobs."""
+
+
+class JobStore:
+    """In-process store for asynchronous processing jobs.
+
+    Jobs run on a small pool of background threads so HTTP workers return
+    immediately; clients poll for status and fetch the encoded result once
+    it is done. Finished jobs are dropped by purge_expired().
+
+    Each waiting job holds its input bytes, so at most max_pending jobs are
+    queued or running; submit() fails fast with JobQueueFullError beyond
+    that. Results are kept up to max_result_bytes in total, the oldest
+    finished jobs being forgotten first to make room.
+    """
+
+    def __init__(self, runner_threads, max_pending, max_result_bytes):
+        self.max_pending = max_pending
+        self.max_result_bytes = max_result_bytes
+        self.result_bytes = 0
+        self.evicted = 0
+        self._jobs = {}
+        self._pending = 0
+        self._finished = OrderedDict()  # job_id -> result bytes, oldest finished first
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=runner_threads, thread_name_prefix="job")
+
+    def submit(self, func, *args):
+        """Queue func(*args, progress=callback) and return the new job id.
+
+        func must return (payload, mimetype, ...) and may call progress(fraction)
+        to report how far along it is.
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise JobQueueFullError("Job queue is full")
+            self._pending += 1
+            self._jobs[job_id] = {
+                "status": "queued",
+                "progress": 0.0,
+                "error": None,
+                "created": time.time(),
+                "finished": None,
+                "result": None,
+            }
+        self._executor.submit(self._run, job_id, func, args)
+        return job_id
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def _run(self, job_id, func, args):
+        self._update(job_id, status="running")
+
+        def progress(fraction):
+            self._update(job_id, progress=round(min(max(fraction, 0.0), 1.0), 3))
+
+        try:
+            result = func(*args, progress=progress)
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self._finish(job_id, status="failed", error=str(e))
+            return
+        if len(result[0]) > self.max_result_bytes:
+            self._finish(job_id, status="failed", error=(
+                f"Result is {len(result[0])} bytes, more than the {self.max_result_bytes} bytes kept for jobs"
+            ))
+            return
+        self._finish(job_id, status="done", progress=1.0, result=result)
+
+    def _finish(self, job_id, **fields):
+        """Record a job's outcome, evicting the oldest results until its own fits."""
+        size = len(fields["result"][0]) if fields.get("result") is not None else 0
+        with self._lock:
+            self._pending -= 1
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields, finished=time.time())
+            while self._finished and self.result_bytes + size > self.max_result_bytes:
+                old_id, old_size = self._finished.popitem(last=False)
+                del self._jobs[old_id]
+                self.result_bytes -= old_size
+                self.evicted += 1
+                print(f"Evicted result of job {old_id} over the job result limit")
+            self._finished[job_id] = size
+            self.result_bytes += size
+
+    def status(self, job_id):
+        """Return the public view of a job, or None if it is unknown or expired."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {
+                "job_id": job_id,
+                "status": job["status"],
+                "progress": job["progress"],
+                "error": job["error"],
+                "created": job["created"],
+                "finished": job["finished"],
+            }
+
+    def result(self, job_id):
+        """Return the result tuple of a finished job, or None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job["result"] if job is not None else None
+
+    def purge_expired(self, max_age_seconds):
+        """Forget finished jobs older than max_age_seconds; return how many."""
+        cutoff = time.time() - max_age_seconds
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job["finished"] is not None and job["finished"] < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+                self.result_bytes -= self._finished.pop(job_id, 0)
+        return len(expired)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
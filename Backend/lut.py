@@ -0,0 +1,111 @@
+import numpy as np
+
+# Lookup table that leaves every intensity unchanged
+IDENTITY = np.arange(256, dtype=np.uint8)
+
+
+def channel_count(img_array):
+    return img_array.shape[2] if len(img_array.shape) == 3 else 1
+
+
+def channel_histograms(img_array):
+    """256-bin histogram of every channel, shape (channels, 256)."""
+    if len(img_array.shape) == 2:
+        return np.bincount(img_array.ravel(), minlength=256)[np.newaxis]
+    return np.stack([
+        np.bincount(img_array[:, :, c].ravel(), minlength=256)
+        for c in range(img_array.shape[2])
+    ])
+
+
+def remap_histograms(hists, luts):
+    """Histograms of an image after luts, computed from its histograms before them."""
+    return np.stack([
+        np.bincount(lut, weights=hist, minlength=256).astype(np.int64)
+        for hist, lut in zip(hists, luts)
+    ])
+
+
+def apply_luts(img_array, luts, out=None):
+    """Map every channel of a uint8 array through its 256-entry table in one pass.
+
+    luts has shape (channels, 256). out may be img_array itself.
+    """
+    if out is None:
+        out = np.empty_like(img_array)
+    if len(img_array.shape) == 2 or (luts == luts[0]).all():
+        np.take(luts[0], img_array, out=out, mode="clip")
+    else:
+        for c in range(img_array.shape[2]):
+            np.take(luts[c], img_array[:, :, c], out=out[:, :, c], mode="clip")
+    return out
+
+
+def quantize_lut(channels, histograms, levels=4):
+    """Table for quantize: (value // factor) * factor on every channel."""
+    factor = 256 // levels  # 256 for levels=1, which does not fit in uint8
+    table = (np.arange(256, dtype=np.int32) // factor) * factor
+    return np.tile(table.astype(np.uint8), (channels, 1))
+
+
+def grayscale_lut(channels, histograms):
+    """Grayscale is a no-op on single-channel images; anything else mixes channels."""
+    if channels != 1:
+        return None
+    return IDENTITY[np.newaxis]
+
+
+class PointOperations:
+    """Point operations of one backend, compiled into per-channel lookup tables.
+
+    builders maps an operation name to builder(channels, histograms, **params),
+    which returns a (channels, 256) uint8 table or None when the operation is
+    not a per-channel point operation for that many channels. histograms() gives
+    the per-channel histograms of the image the table will be applied to, for
+    operations such as histogram equalization that depend on the image.
+    apply(img_array, luts, out) maps an array through the tables.
+    """
+
+    def __init__(self, builders, apply=apply_luts):
+        self.builders = builders
+        self.apply = apply
+
+    def __contains__(self, name):
+        return name in self.builders
+
+    def compile(self, img_array, steps):
+        """Fold the leading point steps into one table per channel.
+
+        Returns (luts, consumed); luts is None when no step could be folded.
+        The source histograms are counted at most once, however many steps
+        need them: later steps see them remapped through the tables so far.
+        """
+        channels = channel_count(img_array)
+        luts = None
+        source_hists = None
+        consumed = 0
+
+        for name, params in steps:
+            if name not in self.builders:
+                break
+
+            def histograms():
+                nonlocal source_hists
+                if source_hists is None:
+                    source_hists = channel_histograms(img_array)
+                return source_hists if luts is None else remap_histograms(source_hists, luts)
+
+            step_luts = self.builders[name](channels, histograms, **params)
+            if step_luts is None:
+                break
+            luts = step_luts if luts is None else np.stack([s[l] for s, l in zip(step_luts, luts)])
+            consumed += 1
+
+        return luts, consumed
+
+    def run(self, img_array, steps, out=None):
+        """Apply the leading point steps in a single pass; return (result, consumed)."""
+        luts, consumed = self.compile(img_array, steps)
+        if luts is None:
+            return img_array, 0
+        return self.apply(img_array, luts, out), consumed
@@ -0,0 +1,25 @@
+import io
+
+from flask import Request
+
+# Cap used when the app sets no MAX_CONTENT_LENGTH, since nothing is spooled to disk
+DEFAULT_MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
+
+
+class InMemoryRequest(Request):
+    """Flask request that keeps multipart uploads in memory.
+
+    Werkzeug spools file parts larger than 500KB to a temporary file; with
+    this class every part is buffered in a BytesIO instead, so single-shot
+    endpoints can decode straight from the request without any disk I/O.
+    The app's MAX_CONTENT_LENGTH bounds how much is buffered, or
+    DEFAULT_MAX_CONTENT_LENGTH when it sets none.
+    """
+
+    @property
+    def max_content_length(self):
+        limit = super().max_content_length
+        return DEFAULT_MAX_CONTENT_LENGTH if limit is None else limit
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
@@ -0,0 +1,169 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from cache hits up to very large local filters
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names."""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, labels=(), amount=1):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition format."""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {}  # labels -> [count per bucket..., sum, count]
+        _registry.append(self)
+
+    def observe(self, value, labels=()):
+        with _lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, state in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, state):
+                label_text = _format_labels(self.labelnames, labels, [("le", bound)])
+                lines.append(f"{self.name}_bucket{label_text} {count}")
+            label_text = _format_labels(self.labelnames, labels, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{label_text} {state[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {state[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {state[-1]}")
+        return lines
+
+
+REQUESTS = Counter(
+    "image_requests_total", "Requests handled, by endpoint, operation, backend and status.",
+    ("endpoint", "operation", "backend", "status"),
+)
+ERRORS = Counter(
+    "image_request_errors_total", "Requests that ended with a 4xx or 5xx status.",
+    ("endpoint", "operation", "backend", "status"),
+)
+REQUEST_SECONDS = Histogram(
+    "image_request_duration_seconds", "Wall time spent handling a request.",
+    ("endpoint", "operation", "backend"),
+)
+STAGE_SECONDS = Histogram(
+    "image_stage_duration_seconds", "Time spent in each stage (upload, read, decode, filter, encode).",
+    ("stage", "endpoint", "operation", "backend"),
+)
+BYTES_IN = Counter("image_bytes_in_total", "Request body bytes received.", ("endpoint", "backend"))
+BYTES_OUT = Counter("image_bytes_out_total", "Encoded result bytes sent.", ("endpoint", "backend"))
+PIXELS = Counter("image_pixels_decoded_total", "Pixels decoded from uploads.", ("endpoint", "backend"))
+
+
+def render_prometheus():
+    """Render every registered metric in the Prometheus text format."""
+    with _lock:
+        lines = []
+        for metric in _registry:
+            lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class RequestTiming:
+    """Per-request timing record: stage durations plus image and byte sizes.
+
+    finish() feeds the metrics above and prints the record as one JSON log
+    line. A RequestTiming that is never finished (work outside a request,
+    such as background jobs) costs nothing beyond the timestamps.
+    """
+
+    def __init__(self, endpoint, backend):
+        self.endpoint = endpoint
+        self.backend = backend
+        self.operation = ""
+        self.width = None
+        self.height = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.stages = {}
+        self._backends = set()
+        self._start = time.perf_counter()
+
+    def record_backends(self, backends):
+        """Label the request with the backends that actually ran its steps (in place of the default)."""
+        self._backends.update(backends)
+        self.backend = "+".join(sorted(self._backends))
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def finish(self, status):
+        elapsed = time.perf_counter() - self._start
+        operation = self.operation or "-"
+        REQUESTS.inc((self.endpoint, operation, self.backend, str(status)))
+        if status >= 400:
+            ERRORS.inc((self.endpoint, operation, self.backend, str(status)))
+        REQUEST_SECONDS.observe(elapsed, (self.endpoint, operation, self.backend))
+        for stage, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, (stage, self.endpoint, operation, self.backend))
+        BYTES_IN.inc((self.endpoint, self.backend), self.bytes_in)
+        BYTES_OUT.inc((self.endpoint, self.backend), self.bytes_out)
+        if self.width and self.height:
+            PIXELS.inc((self.endpoint, self.backend), self.width * self.height)
+
+        record = {
+            "endpoint": self.endpoint,
+            "operation": operation,
+            "backend": self.backend,
+            "status": status,
+            "total_ms": round(elapsed * 1000, 2),
+            "stages_ms": {stage: round(seconds * 1000, 2) for stage, seconds in self.stages.items()},
+            "width": self.width,
+            "height": self.height,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
+        print(json.dumps(record))
+        return record
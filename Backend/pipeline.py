@@ -0,0 +1,259 @@
+import inspect
+import json
+import math
+
+import numpy as np
+from PIL import Image
+
+from buffers import POOL
+
+# Modes the array operations understand directly; anything else (palette,
+# 16-bit, CMYK, ...) is converted once at decode time
+ARRAY_MODES = ("L", "RGB", "RGBA")
+
+
+# Allowed ranges for numeric operation parameters, by parameter name
+PARAMETER_RANGES = {
+    "levels": (1, 256),
+    "clip_limit": (0.0, 256.0),
+    "tiles": (1, 64),
+    "radius": (1, 200),
+    "sigma": (0.1, 60.0),
+}
+
+# Parameters measured in pixels, scaled down with the image for previews
+SPATIAL_PARAMETERS = ("radius", "sigma")
+
+# Most steps one pipeline may have; the memory estimate does not grow with
+# step count, so this is what bounds how long a request holds a worker
+MAX_PIPELINE_STEPS = 32
+
+# Accepted long-edge sizes for preview renders
+PREVIEW_EDGE_RANGE = (16, 4096)
+
+
+class PipelineError(ValueError):
+    """Raised when a requested operation list cannot be run."""
+
+
+def gaussian_radius(sigma):
+    """Kernel radius both backends use for a Gaussian blur: 3 sigma, rounded up."""
+    return max(int(math.ceil(3 * sigma)), 1)
+
+
+def parse_steps(steps, operations):
+    """Validate a client operation list and return [(name, params), ...].
+
+    Each step is either an operation name ("grayscale") or an object naming
+    the operation plus its parameters ({"operation": "quantize", "levels": 8}).
+    Parameter values are coerced to the type of the function's default and
+    checked against PARAMETER_RANGES; at most MAX_PIPELINE_STEPS steps are
+    accepted.
+    """
+    if isinstance(steps, str):
+        steps = [steps]
+    if not isinstance(steps, list) or not steps:
+        raise PipelineError("operations must be a non-empty list")
+    if len(steps) > MAX_PIPELINE_STEPS:
+        raise PipelineError(f"A pipeline can have at most {MAX_PIPELINE_STEPS} steps")
+
+    parsed = []
+    for step in steps:
+        if isinstance(step, str):
+            name, raw_params = step, {}
+        elif isinstance(step, dict) and "operation" in step:
+            raw_params = dict(step)
+            name = raw_params.pop("operation")
+        else:
+            raise PipelineError(f"Invalid pipeline step: {step!r}")
+
+        if name not in operations:
+            raise PipelineError(f"Invalid operation: {name}")
+
+        defaults = operation_defaults(operations[name])
+        params = {}
+        for key, value in raw_params.items():
+            if key not in defaults:
+                raise PipelineError(f"Unknown parameter '{key}' for {name}")
+            params[key] = _coerce(name, key, value, defaults[key])
+            if key in PARAMETER_RANGES:
+                low, high = PARAMETER_RANGES[key]
+                if not low <= params[key] <= high:
+                    raise PipelineError(f"'{key}' in {name} must be between {low} and {high}")
+        parsed.append((name, params))
+
+    return parsed
+
+
+def _coerce(name, key, value, default):
+    """Convert a client value to the type of the parameter's default.
+
+    Booleans are refused, and integer parameters only take whole numbers,
+    so 2.7 is an error rather than silently becoming 2.
+    """
+    invalid = PipelineError(f"Invalid value for '{key}' in {name}: {value!r}")
+    if isinstance(value, bool):
+        raise invalid
+    try:
+        if isinstance(default, int):
+            number = float(value)
+            if not number.is_integer():
+                raise invalid
+            return int(number)
+        return type(default)(value)
+    except (TypeError, ValueError, OverflowError):
+        raise invalid
+
+
+def operation_defaults(func):
+    """{name: default} of the optional parameters a client may set for an operation.
+
+    The keyword-only out= every array operation accepts is for callers
+    inside the server, not for clients.
+    """
+    return {
+        name: parameter.default for name, parameter in inspect.signature(func).parameters.items()
+        if parameter.default is not inspect.Parameter.empty and parameter.kind != parameter.KEYWORD_ONLY
+    }
+
+
+def operation_parameters(func):
+    """Names of the optional parameters a client may set for an operation."""
+    return list(operation_defaults(func))
+
+
+def parse_form_steps(form, operations):
+    """Read the operation list from multipart form fields.
+
+    Accepts either "operations" (a JSON-encoded list, as sent to /pipeline)
+    or a single "operation" name.
+    """
+    raw = form.get("operations")
+    if raw:
+        try:
+            steps = json.loads(raw)
+        except ValueError:
+            raise PipelineError("operations must be a JSON-encoded list")
+    else:
+        steps = form.get("operation")
+
+    if not steps:
+        raise PipelineError("No operation provided")
+    return parse_steps(steps, operations)
+
+
+def parse_preview(values):
+    """Read the optional "preview" long-edge size; None means full resolution."""
+    value = (values or {}).get("preview")
+    if value in (None, "", "0", 0):
+        return None
+    try:
+        edge = int(value)
+    except (TypeError, ValueError):
+        raise PipelineError("preview must be an integer long-edge size")
+    low, high = PREVIEW_EDGE_RANGE
+    if not low <= edge <= high:
+        raise PipelineError(f"preview must be between {low} and {high}")
+    return edge
+
+
+def scale_steps(steps, operations, scale):
+    """Scale the pixel-sized parameters of parsed steps for a resized image.
+
+    Defaults are scaled too, so a preview blurs as much, relative to the
+    image, as the full-size render will.
+    """
+    scaled = []
+    for name, params in steps:
+        params = dict(params)
+        defaults = operation_defaults(operations[name])
+        for key in SPATIAL_PARAMETERS:
+            if key not in defaults:
+                continue
+            value = params.get(key, defaults[key]) * scale
+            if isinstance(defaults[key], int):
+                value = round(value)
+            params[key] = max(type(defaults[key])(value), PARAMETER_RANGES[key][0])
+        scaled.append((name, params))
+    return scaled
+
+
+def load_image(source, max_edge=None):
+    """Open and decode an image; return (image, scale).
+
+    With max_edge the image comes back no larger than max_edge on its long
+    side and scale is its size relative to the original. JPEGs are drafted
+    so libjpeg decodes straight to 1/2, 1/4 or 1/8 scale and the full-size
+    image is never decoded; the rest of the way (and other formats) goes
+    through reduce() and a final resample.
+    """
+    image = Image.open(source)
+    original_width = image.width
+    if max_edge is None or max(image.size) <= max_edge:
+        image.load()
+        return image, 1.0
+
+    factor = max_edge / max(image.size)
+    image.draft(None, (max(int(image.width * factor), 1), max(int(image.height * factor), 1)))
+    image.thumbnail((max_edge, max_edge), reducing_gap=2.0)
+    return image, image.width / original_width
+
+
+def array_mode(image):
+    """The mode normalize_mode gives an image: L, RGB or RGBA. Needs only the header."""
+    if image.mode in ARRAY_MODES:
+        return image.mode
+    has_alpha = "A" in image.getbands() or "transparency" in image.info
+    return "RGBA" if has_alpha else "RGB"
+
+
+def normalize_mode(image):
+    """Convert modes the array operations do not handle to L, RGB or RGBA."""
+    mode = array_mode(image)
+    return image if mode == image.mode else image.convert(mode)
+
+
+def image_to_array(image):
+    """Pixels of a decoded PIL image as a uint8 ndarray in an array mode."""
+    return np.asarray(normalize_mode(image))
+
+
+def decode_image(source):
+    """Open a path or file object and return its pixels as a uint8 ndarray."""
+    image = Image.open(source)
+    image.load()
+    return image_to_array(image)
+
+
+def _replace(img_array, result, owned):
+    """Hand an intermediate back to the buffer pool once result replaces it."""
+    if owned and result is not img_array and not np.may_share_memory(result, img_array):
+        POOL.give(img_array)
+    return owned or result is not img_array
+
+
+def run_pipeline(img_array, steps, operations, point_operations=None, owned=False):
+    """Apply parsed steps in order, handing each array straight to the next.
+
+    With point_operations (see lut.py) every run of consecutive point steps
+    is folded into one lookup table per channel and applied in a single
+    pass, in place once the array is an intermediate rather than the input.
+    Intermediates go back to the buffer pool as soon as the next step has
+    replaced them; owned says img_array itself is one (the caller's input
+    is otherwise never written to or recycled).
+    """
+    i = 0
+    while i < len(steps):
+        if point_operations is not None and steps[i][0] in point_operations:
+            result, consumed = point_operations.run(img_array, steps[i:], out=img_array if owned else None)
+            if consumed:
+                owned = _replace(img_array, result, owned)
+                img_array, i = result, i + consumed
+                continue
+
+        name, params = steps[i]
+        result = operations[name](img_array, **params)
+        owned = _replace(img_array, result, owned)
+        img_array = result
+        i += 1
+    return img_array
@@ -0,0 +1,196 @@
+import fcntl
+import importlib
+import json
+import math
+import os
+import tempfile
+
+from pipeline import operation_defaults, run_pipeline
+
+# Operation kinds. Point operations map each pixel on its own, neighborhood
+# operations read a window of rows around it (their halo) and global ones
+# depend on statistics of the whole image.
+POINT = "point"
+NEIGHBORHOOD = "neighborhood"
+GLOBAL = "global"
+
+# Image modes by channel count, as used in benchmark results
+MODES_BY_CHANNELS = {1: "L", 3: "RGB", 4: "RGBA"}
+
+_operations = {}  # name -> {backend: OperationInfo}
+
+
+class OperationInfo:
+    """One backend's implementation of an operation, plus what callers need to know about it."""
+
+    def __init__(self, backend, name, func, kind, halo=0, scratch=0.0):
+        self.backend = backend
+        self.name = name
+        self.func = func
+        self.kind = kind
+        self.halo = halo  # rows needed on each side, a function of the parameters, or None
+        self.scratch = scratch  # working memory beyond input and output, in copies of the image
+        self.parameters = operation_defaults(func)
+
+    def halo_for(self, params):
+        """Rows of context needed on each side for these parameters (None if not strip-wise)."""
+        if callable(self.halo):
+            return self.halo(**params)
+        return self.halo
+
+    def describe(self):
+        return {"kind": self.kind, "parameters": self.parameters}
+
+
+def register_backend(backend, operations, metadata):
+    """Register a backend's OPERATIONS with metadata {name: (kind, halo, scratch)}."""
+    for name, func in operations.items():
+        _operations.setdefault(name, {})[backend] = OperationInfo(backend, name, func, *metadata[name])
+
+
+def implementations(name):
+    """{backend: OperationInfo} for every registered backend implementing name."""
+    return _operations.get(name, {})
+
+
+def halo(name, params):
+    """Largest halo any backend needs for a step, or None if it cannot run in strips."""
+    halos = [info.halo_for(params) for info in implementations(name).values()]
+    if not halos or None in halos:
+        return None
+    return max(halos)
+
+
+def scratch(name, backend):
+    """Working memory a backend needs for a step, in copies of the image.
+
+    Falls back to the most any backend needs when backend does not
+    implement it (e.g. before dispatch has chosen one).
+    """
+    infos = implementations(name)
+    if backend in infos:
+        return infos[backend].scratch
+    return max((info.scratch for info in infos.values()), default=0.0)
+
+
+def describe_operations():
+    """Registry contents for clients: kind, parameters and backends of every operation."""
+    described = {}
+    for name, infos in sorted(_operations.items()):
+        first = next(iter(infos.values()))
+        described[name] = dict(first.describe(), backends=sorted(infos))
+    return described
+
+
+def run_plan(img_array, plan):
+    """Run a dispatch plan, [(backend, steps), ...], handing the array from group to group."""
+    source = img_array
+    for backend, steps in plan:
+        module = importlib.import_module(backend)
+        img_array = run_pipeline(
+            img_array, steps, module.OPERATIONS, module.POINT_OPERATIONS, owned=img_array is not source
+        )
+    return img_array
+
+
+class Dispatcher:
+    """Send each operation to the backend that ran it fastest on similar images.
+
+    Decisions come from benchmark.py results: the filter time of every
+    operation per backend, image mode and size. An operation only moves off
+    the default backend for a mode if the backends' outputs differed by at
+    most max_difference levels on every profiled image; by default they must
+    be identical, as even a one-level difference can be amplified by later
+    steps such as quantize. With the current backends that leaves only
+    quantize and boxblur (and grayscale of already gray images) free to move.
+    """
+
+    def __init__(self, default_backend, results, agreement, max_difference=0):
+        self.default_backend = default_backend
+        self._timings = {}  # (operation, mode) -> {pixels: {backend: seconds}}
+        for record in results:
+            if "filter_s" not in record:
+                continue
+            key = (record["operation"], record["mode"])
+            pixels = record["width"] * record["height"]
+            self._timings.setdefault(key, {}).setdefault(pixels, {})[record["backend"]] = record["filter_s"]
+
+        self._interchangeable = {}
+        for entry in agreement:
+            key = (entry["operation"], entry["mode"])
+            agrees = entry.get("max_abs_diff") is not None and entry["max_abs_diff"] <= max_difference
+            self._interchangeable[key] = self._interchangeable.get(key, True) and agrees
+
+    @classmethod
+    def load(cls, default_backend, profile_path, max_difference=0, sizes="256x256,768x768", repeat=2):
+        """Read a stored profile, or micro-benchmark the importable backends and store one.
+
+        Profiles are benchmark.py output, so one recorded on the production
+        hardware with the benchmark CLI can be used as profile_path directly.
+        Server processes starting together (gunicorn workers) take turns on
+        a lock file next to the profile: the first profiles and the others
+        load what it wrote. The profile is renamed into place once complete.
+        """
+        if not profile_path:
+            profile = _profile_backends(sizes, repeat)
+        else:
+            with open(f"{profile_path}.lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if os.path.exists(profile_path):
+                    with open(profile_path) as f:
+                        profile = json.load(f)
+                    print(f"Loaded backend profile from {profile_path}")
+                else:
+                    profile = _profile_backends(sizes, repeat)
+                    fd, temp_path = tempfile.mkstemp(
+                        prefix=".profile-", dir=os.path.dirname(os.path.abspath(profile_path))
+                    )
+                    try:
+                        with os.fdopen(fd, "w") as f:
+                            json.dump(profile, f, indent=2)
+                        os.replace(temp_path, profile_path)
+                    finally:
+                        if os.path.exists(temp_path):
+                            os.remove(temp_path)
+        return cls(default_backend, profile["results"], profile.get("agreement", []), max_difference)
+
+    def choose(self, name, shape):
+        """Backend to run operation name on an image of this shape."""
+        channels = shape[2] if len(shape) == 3 else 1
+        key = (name, MODES_BY_CHANNELS.get(channels))
+        timings = self._timings.get(key)
+        if not timings or not self._interchangeable.get(key, False):
+            return self.default_backend
+
+        # Timings for the profiled size closest to this image, on a log scale
+        pixels = max(shape[0] * shape[1], 1)
+        nearest = min(timings, key=lambda size: abs(math.log(size / pixels)))
+        by_backend = timings[nearest]
+        return min(by_backend, key=by_backend.get)
+
+    def plan(self, steps, shape):
+        """Split steps into [(backend, steps), ...], merging neighbours on the same backend."""
+        plan = []
+        for step in steps:
+            backend = self.choose(step[0], shape)
+            if plan and plan[-1][0] == backend:
+                plan[-1][1].append(step)
+            else:
+                plan.append((backend, [step]))
+            if step[0] == "grayscale":
+                shape = shape[:2]
+        return plan
+
+
+def _profile_backends(sizes, repeat):
+    """Micro-benchmark the importable backends; returns a profile as Dispatcher.load reads it."""
+    import benchmark  # Only needed when profiling
+
+    backends = benchmark.load_backends(benchmark.BACKENDS)
+    operations = sorted({op for module in backends.values() for op in module.OPERATIONS})
+    results, outputs = benchmark.run_benchmarks(
+        backends, benchmark.parse_sizes(sizes), ("L", "RGB"), operations, repeat,
+        measure_memory=False, verbose=False,
+    )
+    print(f"Profiled {len(backends)} backends on {len(operations)} operations")
+    return {"results": results, "agreement": benchmark.compare_backends(outputs, 2.0)}
@@ -0,0 +1,149 @@
+import tempfile
+
+import numpy as np
+
+from buffers import POOL
+from pipeline import normalize_mode
+from registry import halo
+
+# Rough working memory per image sample while a strip is filtered: the
+# strip itself, padded copies, wide accumulators and the output
+WORKING_BYTES_PER_SAMPLE = 16
+
+
+class TilingError(ValueError):
+    """Raised when a step has no strip-wise implementation."""
+
+
+def is_tileable(steps, global_operations):
+    """True if every step has a strip-wise implementation."""
+    return all(halo(name, params) is not None or name in global_operations for name, params in steps)
+
+
+def scratch_array(shape, dtype, scratch_dir=None):
+    """Zero-filled array backed by an anonymous temporary file.
+
+    The file is unlinked as soon as it is created, so it disappears with
+    the last reference to the array and never needs cleaning up.
+    """
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    with tempfile.TemporaryFile(dir=scratch_dir) as f:
+        f.truncate(max(nbytes, 1))
+        return np.memmap(f, dtype=dtype, mode="r+", shape=shape)
+
+
+def strip_rows(width, channels, halo, budget):
+    """Rows per strip so a strip plus its halo fits in budget bytes (at least 1)."""
+    per_row = max(width * channels * WORKING_BYTES_PER_SAMPLE, 1)
+    return max(budget // per_row - 2 * halo, 1)
+
+
+def _iter_strips(height, rows):
+    for top in range(0, height, rows):
+        yield top, min(top + rows, height)
+
+
+def _shape_info(pixels):
+    height, width = pixels.shape[:2]
+    channels = pixels.shape[2] if len(pixels.shape) == 3 else 1
+    return height, width, channels
+
+
+def decode_to_scratch(image, budget, scratch_dir=None):
+    """Copy a PIL image into a scratch array one strip at a time.
+
+    Only PIL's own decoded buffer and one strip are in RAM; the ndarray
+    copy lives in the memory-mapped scratch file.
+    """
+    image = normalize_mode(image)
+    width, height = image.size
+    channels = len(image.getbands())
+    shape = (height, width) if channels == 1 else (height, width, channels)
+
+    pixels = scratch_array(shape, np.uint8, scratch_dir)
+    for top, bottom in _iter_strips(height, strip_rows(width, channels, 0, budget)):
+        pixels[top:bottom] = np.asarray(image.crop((0, top, width, bottom)))
+    return pixels
+
+
+def _run_strips(source, ops, budget, scratch_dir):
+    """Apply row-local ops strip by strip from source into a new scratch array.
+
+    Each strip is read with the combined halo of all ops on both sides, so
+    every kept row sees exactly the neighbours it would in the full image;
+    the halo rows themselves are filtered against an artificial border and
+    dropped. Strip-sized intermediates go back to the buffer pool, so every
+    strip after the first reuses the previous strip's memory.
+    """
+    height, width, channels = _shape_info(source)
+    halo = sum(op_halo for _, op_halo in ops)
+    result = None
+
+    for top, bottom in _iter_strips(height, strip_rows(width, channels, halo, budget)):
+        lo, hi = max(top - halo, 0), min(bottom + halo, height)
+        block = np.asarray(source[lo:hi])
+        for func, _ in ops:
+            filtered = func(block)
+            if filtered is not block:
+                POOL.give(block)  # Ignored for the view of source
+            block = filtered
+        if result is None:
+            result = scratch_array((height,) + block.shape[1:], block.dtype, scratch_dir)
+        result[top:bottom] = block[top - lo:bottom - lo]
+        POOL.give(block)
+
+    return result
+
+
+def _gather_statistics(source, statistics, params, budget):
+    """Sum an operation's statistics over all strips of source."""
+    height, width, channels = _shape_info(source)
+    total = None
+    for top, bottom in _iter_strips(height, strip_rows(width, channels, 0, budget)):
+        stats = statistics(np.asarray(source[top:bottom]), **params)
+        total = stats if total is None else total + stats
+    return total
+
+
+def result_rows(result, budget):
+    """Rows per strip for reading a tiled result back (to encode it) within budget bytes."""
+    height, width, channels = _shape_info(result)
+    return strip_rows(width, channels, 0, budget)
+
+
+def run_tiled(image, steps, operations, global_operations, budget, scratch_dir=None):
+    """Run parsed steps on a PIL image in strips, filtering within about budget bytes of RAM.
+
+    Consecutive point and neighbourhood steps are fused into one pass over
+    the image. A whole-image step (histogram equalization) first gathers
+    its statistics strip by strip and then joins the next pass as a point
+    operation. Intermediate results spill to memory-mapped scratch files.
+    The returned memmap-backed array is identical to run_pipeline's result.
+
+    image is closed once copied into scratch, releasing PIL's decoded
+    pixels. Until then the whole decoded image is in memory, so only the
+    filtering itself is bounded; encoding the result also adds one
+    in-memory copy unless it is written as PNG from result_rows strips
+    (see encode_array).
+    """
+    current = decode_to_scratch(image, budget, scratch_dir)
+    image.close()
+    pending = []
+
+    for name, params in steps:
+        if name in global_operations:
+            if pending:
+                current = _run_strips(current, pending, budget, scratch_dir)
+                pending = []
+            statistics, apply = global_operations[name]
+            stats = _gather_statistics(current, statistics, params, budget)
+            pending.append((lambda block, apply=apply, stats=stats, params=params: apply(block, stats, **params), 0))
+        elif halo(name, params) is not None:
+            func = operations[name]
+            pending.append((lambda block, func=func, params=params: func(block, **params), halo(name, params)))
+        else:
+            raise TilingError(f"{name} cannot be processed in tiles")
+
+    if pending:
+        current = _run_strips(current, pending, budget, scratch_dir)
+    return current
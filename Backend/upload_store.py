@@ -0,0 +1,271 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Prefix of files still being written; never handed out, removed once stale
+TEMP_PREFIX = ".upload-"
+
+# Index of the stored files, kept in the upload directory itself; like the
+# temporary files its name starts with a dot, which no content hash does
+INDEX_NAME = ".index.sqlite3"
+
+
+class UploadQuotaError(ValueError):
+    """Raised for an upload larger than the whole disk quota."""
+
+
+class UploadStore:
+    """Uploaded files kept on disk under their content hash, with expiry and a disk quota.
+
+    Identical uploads share one file: every put() takes a reference and
+    release() drops one, deleting the file with the last. A file also goes
+    max_age seconds after it was last uploaded, and storing a new file that
+    would take the total over max_bytes first evicts the least recently
+    used ones.
+
+    Size, deadline, references and last use of every file live in an
+    SQLite index in the directory, so all server processes sharing it
+    (gunicorn workers) see the same references, a clear() and a quota that
+    holds for the directory as a whole. Expiry and eviction are indexed
+    queries rather than directory scans. The counters in stats() are this
+    process's own.
+    """
+
+    def __init__(self, directory, max_age, max_bytes):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.stored = 0
+        self.deduplicated = 0
+        self.expired = 0
+        self.evicted = 0
+        self._local = threading.local()  # Connection per thread
+        self._index_existing()
+
+    def _connection(self):
+        """This thread's connection to the index, reopened when the index file was replaced or removed."""
+        path = self._path(INDEX_NAME)
+        try:
+            inode = os.stat(path).st_ino
+        except FileNotFoundError:
+            inode = None  # Another process removed the directory; start a new index
+        if inode is not None and getattr(self._local, "key", None) == (os.getpid(), inode):
+            return self._local.db
+        if getattr(self._local, "key", (None,))[0] == os.getpid():
+            self._local.db.close()  # Connections inherited across a fork are left alone
+
+        os.makedirs(self.directory, exist_ok=True)
+        db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")  # Readers do not wait for writers
+        db.execute("PRAGMA synchronous=NORMAL")  # Uploads are transient; no fsync per commit
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS uploads (name TEXT PRIMARY KEY, size INTEGER NOT NULL,"
+            " deadline REAL NOT NULL, refs INTEGER NOT NULL, used REAL NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS uploads_deadline ON uploads (deadline)")
+        db.execute("CREATE INDEX IF NOT EXISTS uploads_used ON uploads (used)")
+        self._local.db, self._local.key = db, (os.getpid(), os.stat(path).st_ino)
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        """Hold the index's write lock, shared by all processes, until the block ends."""
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _index_existing(self):
+        """Index files the index does not know (left by an earlier run) and forget vanished ones."""
+        now = time.time()
+        with self._transaction() as db:
+            known = {name for name, in db.execute("SELECT name FROM uploads")}
+            for entry in os.scandir(self.directory):
+                if not entry.is_file():
+                    continue
+                info = entry.stat()
+                if entry.name.startswith(TEMP_PREFIX):
+                    # Another process may still be writing a recent one
+                    if info.st_mtime + self.max_age <= now:
+                        self._unlink(entry.name)
+                    continue
+                if entry.name.startswith("."):  # The index itself
+                    continue
+                if entry.name in known:
+                    known.discard(entry.name)
+                    continue
+                db.execute(
+                    "INSERT INTO uploads VALUES (?, ?, ?, 1, ?)",
+                    (entry.name, info.st_size, info.st_mtime + self.max_age, info.st_mtime),
+                )
+            for name in known:
+                db.execute("DELETE FROM uploads WHERE name = ?", (name,))
+            self._evict(db, 0)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _name(self, file_path):
+        """Stored name for a client-supplied path; only the final component counts."""
+        return os.path.basename(file_path or "")
+
+    def _unlink(self, name):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Failed to remove {self._path(name)}: {e}")
+
+    def _find(self, db, name):
+        """Whether name is stored; an entry whose file was removed behind the index's back is dropped."""
+        if db.execute("SELECT 1 FROM uploads WHERE name = ?", (name,)).fetchone() is None:
+            return False
+        if os.path.exists(self._path(name)):
+            return True
+        db.execute("DELETE FROM uploads WHERE name = ?", (name,))
+        return False
+
+    def _drop(self, db, name):
+        """Forget an upload and delete its file (in a transaction)."""
+        db.execute("DELETE FROM uploads WHERE name = ?", (name,))
+        self._unlink(name)
+
+    def _total_bytes(self, db):
+        return db.execute("SELECT COALESCE(SUM(size), 0) FROM uploads").fetchone()[0]
+
+    def _evict(self, db, needed):
+        """Delete least recently used files until needed more bytes fit the directory's quota."""
+        total = self._total_bytes(db)
+        while total + needed > self.max_bytes:
+            row = db.execute("SELECT name, size FROM uploads ORDER BY used LIMIT 1").fetchone()
+            if row is None:
+                return
+            name, size = row
+            self._drop(db, name)
+            total -= size
+            self.evicted += 1
+            print(f"Evicted upload over quota: {self._path(name)}")
+
+    def put(self, data):
+        """Store uploaded bytes and return their file path."""
+        name = hashlib.sha256(data).hexdigest()
+        with self._transaction() as db:
+            if self._take_existing(db, name):
+                return self._path(name)
+        if len(data) > self.max_bytes:
+            raise UploadQuotaError(f"Upload is larger than the {self.max_bytes // 2**20}MB upload quota")
+
+        # Written outside the lock and renamed into place, so readers never
+        # see a partial file and other uploads are not held up
+        fd, temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            with self._transaction() as db:
+                if self._take_existing(db, name):  # The same bytes arrived meanwhile
+                    return self._path(name)
+                self._evict(db, len(data))
+                os.replace(temp_path, self._path(name))
+                now = time.time()
+                db.execute(
+                    "INSERT INTO uploads VALUES (?, ?, ?, 1, ?)", (name, len(data), now + self.max_age, now)
+                )
+                self.stored += 1
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return self._path(name)
+
+    def _take_existing(self, db, name):
+        """Add a reference to an already stored upload and push back its expiry (in a transaction).
+
+        An entry whose file is gone counts as a miss, so the bytes are stored again.
+        """
+        if not self._find(db, name):
+            return False
+        now = time.time()
+        db.execute(
+            "UPDATE uploads SET refs = refs + 1, deadline = ?, used = ? WHERE name = ?",
+            (now + self.max_age, now, name),
+        )
+        self.deduplicated += 1
+        return True
+
+    def contains(self, file_path):
+        name = self._name(file_path)
+        with self._transaction() as db:
+            return self._find(db, name)
+
+    def read(self, file_path):
+        """Bytes of a stored upload, or None if it is unknown or already gone."""
+        name = self._name(file_path)
+        with self._transaction() as db:
+            if not self._find(db, name):
+                return None
+            db.execute("UPDATE uploads SET used = ? WHERE name = ?", (time.time(), name))
+        try:
+            with open(self._path(name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:  # Expired or evicted since the check
+            return None
+
+    def release(self, file_path):
+        """Drop one reference; the file is deleted with the last. Returns whether it was deleted."""
+        name = self._name(file_path)
+        with self._transaction() as db:
+            row = db.execute("SELECT refs FROM uploads WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return False
+            if row[0] > 1:
+                db.execute("UPDATE uploads SET refs = refs - 1 WHERE name = ?", (name,))
+                return False
+            self._drop(db, name)
+            return True
+
+    def expire(self, now=None):
+        """Delete every upload past its deadline; return how many went."""
+        now = time.time() if now is None else now
+        with self._transaction() as db:
+            names = [name for name, in db.execute("SELECT name FROM uploads WHERE deadline <= ?", (now,))]
+            for name in names:
+                self._drop(db, name)
+            self.expired += len(names)
+        return len(names)
+
+    def next_expiry(self):
+        """Seconds until the next upload expires, or None when there are none."""
+        with self._transaction() as db:
+            deadline = db.execute("SELECT MIN(deadline) FROM uploads").fetchone()[0]
+        return None if deadline is None else max(deadline - time.time(), 0.0)
+
+    def clear(self):
+        """Delete every stored upload, for every process sharing the directory."""
+        with self._transaction() as db:
+            for name, in db.execute("SELECT name FROM uploads").fetchall():
+                self._drop(db, name)
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.startswith("."):
+                    self._unlink(entry.name)
+
+    def stats(self):
+        with self._transaction() as db:
+            files, total_bytes = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM uploads").fetchone()
+        return {
+            "files": files,
+            "total_bytes": total_bytes,
+            "max_bytes": self.max_bytes,
+            "max_age_seconds": self.max_age,
+            "stored": self.stored,
+            "deduplicated": self.deduplicated,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,128 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from buffers import POOL
+from registry import run_plan
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the pool already has its maximum number of queued jobs."""
+
+
+class WorkerCrashedError(RuntimeError):
+    """Raised when a job took down its worker process again after one retry."""
+
+
+def _attach(name):
+    """Attach to an existing shared memory block owned by the parent.
+
+    Workers are forked after the parent created its first block, so they
+    share the parent's resource tracker and the parent's unlink() is the
+    only cleanup needed.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        return shared_memory.SharedMemory(name=name)
+
+
+def _run_in_worker(plan, in_name, shape, dtype, out_name):
+    """Worker entry point: run a dispatch plan on the shared input, write the shared output."""
+    in_shm = _attach(in_name)
+    out_shm = _attach(out_name)
+    img_array = result = None
+    try:
+        img_array = np.ndarray(shape, dtype=dtype, buffer=in_shm.buf)
+        result = run_plan(img_array, plan)
+        if result.nbytes > out_shm.size:
+            raise ValueError("Processed image is larger than the output buffer")
+        np.ndarray(result.shape, dtype=result.dtype, buffer=out_shm.buf)[...] = result
+        POOL.give(result)  # Ignored if it is the shared input itself
+        return result.shape, result.dtype.str
+    finally:
+        # Views into the blocks must be gone before they can be closed
+        img_array = result = None
+        in_shm.close()
+        out_shm.close()
+
+
+class ProcessingPool:
+    """Process pool for CPU-bound operations with a bounded queue.
+
+    Pixels travel through shared memory rather than being pickled, and at
+    most workers + queue_depth jobs are admitted at once; further calls fail
+    fast with QueueFullError so the server can answer 503 immediately.
+    """
+
+    def __init__(self, workers, queue_depth):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._executor_lock = threading.Lock()
+        self.restarts = 0
+        self._executor = self._new_executor()
+
+    def _new_executor(self):
+        # fork: workers inherit the loaded modules and never re-run the app's
+        # module-level setup (cleanup thread, atexit upload removal)
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("fork"))
+
+    def _replace_broken(self, executor):
+        """Swap in a fresh executor for one whose worker died, unless another thread already did."""
+        with self._executor_lock:
+            if self._executor is executor:
+                print("Processing pool worker died; starting a new pool")
+                self._executor = self._new_executor()
+                self.restarts += 1
+                executor.shutdown(wait=False)
+
+    def _submit_and_wait(self, *args):
+        """Run _run_in_worker, retrying once on a fresh pool if a worker process dies.
+
+        A dead worker (killed by the OOM killer, say) breaks the whole
+        executor, so it is replaced rather than failing every later call.
+        """
+        for _ in range(2):
+            with self._executor_lock:
+                executor = self._executor
+            try:
+                return executor.submit(_run_in_worker, *args).result()
+            except BrokenProcessPool:
+                self._replace_broken(executor)
+        raise WorkerCrashedError("Processing worker crashed")
+
+    def run(self, plan, img_array):
+        """Run a dispatch plan, [(backend, steps), ...], on img_array in a worker."""
+        if not self._slots.acquire(blocking=False):
+            raise QueueFullError("Processing queue is full")
+
+        in_shm = out_shm = None
+        try:
+            img_array = np.ascontiguousarray(img_array)
+            size = max(img_array.nbytes, 1)
+            in_shm = shared_memory.SharedMemory(create=True, size=size)
+            # Every operation returns at most as many bytes as it was given
+            out_shm = shared_memory.SharedMemory(create=True, size=size)
+            np.ndarray(img_array.shape, dtype=img_array.dtype, buffer=in_shm.buf)[...] = img_array
+
+            shape, dtype = self._submit_and_wait(
+                plan, in_shm.name, img_array.shape, img_array.dtype.str, out_shm.name,
+            )
+            result = POOL.take(shape, dtype)
+            result[...] = np.ndarray(shape, dtype=dtype, buffer=out_shm.buf)
+            return result
+        finally:
+            for shm in (in_shm, out_shm):
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
+            self._slots.release()
+
+    def shutdown(self):
+        with self._executor_lock:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -4,6 +4,10 @@ import { motion } from "framer-motion";
 import { useDropzone } from "react-dropzone";
 import { ClipLoader } from "react-spinners";
 
+// Long edge of the on-screen result. Filters are previewed at this size;
+// the full-resolution image is only rendered when it is downloaded.
+const PREVIEW_EDGE = 1280;
+
 export default function ImageProcessor() {
   const [image, setImage] = useState(null);
   const [preview, setPreview] = useState(null);
@@ -34,6 +38,10 @@ export default function ImageProcessor() {
       title: "Histogram Equalization",
       description: "Enhances image contrast by redistributing pixel intensity values. This technique helps reveal details in over or underexposed areas by stretching the intensity range across the entire spectrum."
     },
+    clahe: {
+      title: "Adaptive Equalization (CLAHE)",
+      description: "Equalizes contrast separately in small regions of the image and blends them smoothly, with a limit on how far contrast may be stretched. This evens out uneven lighting, such as shadows across a scanned document, without amplifying noise in flat areas."
+    },
     smooth: {
       title: "Smooth Filter",
       description: "Reduces noise and details in the image using a Gaussian blur. This filter softens sharp edges and creates a more even appearance, useful for removing grain or imperfections."
@@ -140,7 +148,7 @@ export default function ImageProcessor() {
     try {
       const response = await axios.post(
         `https://image-enhancer-hqtl.onrender.com/process/${op}`,
-        { file_path: filePath },
+        { file_path: filePath, preview: PREVIEW_EDGE },
         { responseType: "blob" }
       );
       setProcessedImage(URL.createObjectURL(response.data));
@@ -178,14 +186,36 @@ export default function ImageProcessor() {
     setFilterInfo(filterInfoData.default);
   };
 
-  const saveImage = () => {
+  const saveImage = async () => {
     if (!processedImage) return;
-    const link = document.createElement("a");
-    link.href = processedImage;
-    link.download = `processed_${operation}.jpg`;
-    document.body.appendChild(link);
-    link.click();
-    document.body.removeChild(link);
+
+    // The displayed result is a preview; render the full-size image now
+    const filePath = await uploadImage();
+    if (!filePath) {
+      setLoading(false);
+      return;
+    }
+
+    try {
+      const response = await axios.post(
+        `https://image-enhancer-hqtl.onrender.com/process/${operation}`,
+        { file_path: filePath },
+        { responseType: "blob" }
+      );
+      const url = URL.createObjectURL(response.data);
+      const extension = response.data.type.split("/")[1] || "png";
+      const link = document.createElement("a");
+      link.href = url;
+      link.download = `processed_${operation}.${extension}`;
+      document.body.appendChild(link);
+      link.click();
+      document.body.removeChild(link);
+      setTimeout(() => URL.revokeObjectURL(url), 0);
+    } catch (error) {
+      console.error("Download error:", error);
+    } finally {
+      setLoading(false);
+    }
   };
 
   return (
@@ -268,6 +298,12 @@ export default function ImageProcessor() {
                 >
                   Histogram
                 </button>
+                <button 
+                  onClick={() => processImage("clahe")} 
+                  className={`btn px-3 py-2.5 rounded-lg text-sm sm:text-base transition-all ${operation === "clahe" && processedImage ? "bg-green-600 hover:bg-green-700" : "bg-blue-600 hover:bg-blue-700"}`}
+                >
+                  Adaptive EQ
+                </button>
                 <button 
                   onClick={() => processImage("smooth")} 
                   className={`btn px-3 py-2.5 rounded-lg text-sm sm:text-base transition-all ${operation === "smooth" && processedImage ? "bg-green-600 hover:bg-green-700" : "bg-blue-600 hover:bg-blue-700"}`}
@@ -288,7 +324,7 @@ export default function ImageProcessor() {
                 </button>
                 <button 
                   onClick={() => processImage("lowpass")} 
-                  className={`btn col-span-2 px-3 py-2.5 rounded-lg text-sm sm:text-base transition-all ${operation === "lowpass" && processedImage ? "bg-green-600 hover:bg-green-700" : "bg-blue-600 hover:bg-blue-700"}`}
+                  className={`btn px-3 py-2.5 rounded-lg text-sm sm:text-base transition-all ${operation === "lowpass" && processedImage ? "bg-green-600 hover:bg-green-700" : "bg-blue-600 hover:bg-blue-700"}`}
                 >
                   Low-Pass
                 </button>